@@ -0,0 +1,168 @@
+"""Per-location daily archive: one flat float32 file per metric, memory-mapped.
+
+cache/archive/v<ARCHIVE_VERSION>/<provider>/<cell>/ holds:
+
+- `<metric>.f32`: day i is BASE_DATE + i days, in units.CANONICAL. NaN where
+  there's no value.
+- `months.u8`: month i (months since BASE_DATE) is 1 once it's been archived.
+
+Files only ever grow (with NaN), so any date range is a zero-copy slice of a
+numpy.memmap, and reading decades of a location parses nothing. It's all derived
+from cache/objects/, so it's safe to delete.
+"""
+
+from collections import OrderedDict
+from datetime import date
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from cache import file_lock
+from dataset import Metrics
+from dates import MonthSpan
+
+ARCHIVE_ROOT = "cache/archive"
+
+# bump when what's archived changes (e.g., units), so old archives aren't read
+ARCHIVE_VERSION = 2
+
+# open Archives kept at once. each holds a file descriptor per mapped file (~24 for
+# a VC location), so hundreds of locations can't all stay open.
+MAX_OPEN = 16
+
+# day 0 of every metric file. ~80KB per metric per location, up to today.
+BASE_DATE = date(1970, 1, 1)
+
+MISSING = np.float32("nan")
+
+
+def day_index(d: date) -> int:
+    return (d - BASE_DATE).days
+
+
+def month_index(year: int, month: int) -> int:
+    return (year - BASE_DATE.year) * 12 + month - 1
+
+
+def grow(path: str, n: int, dtype: np.dtype, fill) -> bool:
+    """Pads path with fill up to n items. Returns whether it grew."""
+    have = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+    if have >= n:
+        return False
+    with open(path, "ab") as f:
+        f.write(np.full(n - have, fill, dtype=dtype).tobytes())
+    return True
+
+
+class Archive:
+    """One (provider, location)'s archive. Safe to share between threads."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        # open maps, reopened whenever their file grows
+        self.maps: Dict[str, np.memmap] = {}
+        self.names: Optional[List[str]] = None
+
+    def _map(self, name: str, dtype) -> Optional[np.memmap]:
+        if name not in self.maps:
+            path = os.path.join(self.path, name)
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                return None
+            self.maps[name] = np.memmap(path, dtype=dtype, mode="r+")
+        return self.maps[name]
+
+    def _map_at_least(self, name: str, dtype: np.dtype, n: int, fill) -> np.memmap:
+        """Map of name, grown to n items if it's shorter."""
+        grow(os.path.join(self.path, name), n, dtype, fill)
+        m = self._map(name, dtype)
+        if m is not None and len(m) < n:
+            # grown since we mapped it, by us or another process
+            del self.maps[name]
+            m = self._map(name, dtype)
+        assert m is not None, f"{name} was just grown"
+        return m
+
+    def metrics(self) -> List[str]:
+        if self.names is None:
+            names = os.listdir(self.path) if os.path.isdir(self.path) else []
+            self.names = sorted(n[: -len(".f32")] for n in names if n.endswith(".f32"))
+        return self.names
+
+    def has_month(self, span: MonthSpan) -> bool:
+        months = self._map("months.u8", np.uint8)
+        i = month_index(span.year, span.month)
+        return months is not None and i < len(months) and months[i] == 1
+
+    def read(self, metric: str, start: date, end: date) -> np.ndarray:
+        """Days start..end (inclusive) of metric, as a view into the file. NaN for
+        days past the end of the file."""
+        values = self._map(metric + ".f32", np.float32)
+        lo, hi = day_index(start), day_index(end) + 1
+        if values is None or hi > len(values):
+            padded = np.full(hi - lo, MISSING, dtype=np.float32)
+            if values is not None and lo < len(values):
+                padded[: len(values) - lo] = values[lo:]
+            return padded
+        return values[lo:hi]
+
+    def close(self):
+        """Drops the maps; each file is unmapped (and its fd closed) once nothing
+        still holds a slice of it. Maps are reopened if the archive is used again."""
+        with self.lock:
+            self.maps.clear()
+
+    def month(self, span: MonthSpan) -> Optional[Metrics]:
+        """The month's metrics as memmap slices, or None if it isn't archived."""
+        with self.lock:
+            if not self.has_month(span):
+                return None
+            return {
+                metric: self.read(metric, span.start, span.end)
+                for metric in self.metrics()
+            }
+
+    def write_month(self, span: MonthSpan, metrics: Metrics):
+        """Archives a month's metrics (without provenance lists)."""
+        with self.lock, file_lock(os.path.join(self.path, ".lock")):
+            self.names = None
+            end = day_index(span.end) + 1
+            for metric, values in metrics.items():
+                if metric.endswith("_source"):
+                    continue
+                m = self._map_at_least(
+                    metric + ".f32", np.dtype(np.float32), end, MISSING
+                )
+                m[day_index(span.start) : end] = np.asarray(values, dtype=np.float32)
+                m.flush()
+            # marked last, so a half-written month is never read
+            i = month_index(span.year, span.month)
+            months = self._map_at_least("months.u8", np.dtype(np.uint8), i + 1, 0)
+            months[i] = 1
+            months.flush()
+
+
+class Archives:
+    """Archive per (provider, location cell), opened on first use. Only the
+    max_open most recently used stay open; see Archive.close."""
+
+    def __init__(self, root: str = ARCHIVE_ROOT, max_open: int = MAX_OPEN):
+        self.root = root
+        self.max_open = max_open
+        self.archives: "OrderedDict[Tuple[str, str], Archive]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, provider: str, cell: str) -> Archive:
+        with self.lock:
+            key = (provider, cell)
+            if key not in self.archives:
+                self.archives[key] = Archive(
+                    os.path.join(self.root, f"v{ARCHIVE_VERSION}", provider, cell)
+                )
+            self.archives.move_to_end(key)
+            while len(self.archives) > self.max_open:
+                _, evicted = self.archives.popitem(last=False)
+                evicted.close()
+            return self.archives[key]
@@ -0,0 +1,516 @@
+"""Quick benchmarks. Runs offline, using doc/response.py as the fixture.
+
+python bench.py
+
+Or, the budgeted suite: cold builds (fetching from local stand-ins for Visual
+Crossing and meteostat), warm builds and render-only runs, each checked against
+BUDGETS and against the last few runs in output/bench-history.jsonl. Exits 1 on
+any miss.
+
+python bench.py --check
+"""
+
+import argparse
+import ast
+from contextlib import contextmanager, redirect_stdout
+import copy
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import orjson
+
+import archive
+import cache
+from dataset import Data
+import units
+
+
+def fixture_vc_month(n_days: int = 31, unit_group: str = "us") -> Dict[str, Any]:
+    """A full VC response for one month, built by repeating doc/response.py's day.
+    doc/response.py is in "us" units; unit_group="metric" converts it, as VC would."""
+    with open("doc/response.py") as f:
+        response = ast.literal_eval(f.read())
+    day = response["days"][0]
+    response["days"] = []
+    for i in range(n_days):
+        d = copy.deepcopy(day)
+        d["tempmax"] = day["tempmax"] - i * 0.7
+        d["precip"] = i * 0.01
+        response["days"].append(d)
+    if unit_group == "metric":
+        for metric in units.TO_IMPERIAL:
+            if day.get(metric) is None:
+                continue
+            values = np.array([d[metric] for d in response["days"]], dtype=float)
+            converted = np.round(units.from_imperial(values, metric), 1).tolist()
+            for d, value in zip(response["days"], converted):
+                d[metric] = value
+    return response
+
+
+def timed(label: str, fn: Callable[[], Any], n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    per = (time.perf_counter() - start) / n
+    print(f"{label:<40} {per * 1e6:9.1f} us")
+    return per
+
+
+def bench_vc_decode(n: int = 500) -> Dict[str, float]:
+    """Warm-cache decoding of one VC month: old path vs. the current one."""
+    print("VC month decode")
+    response = fixture_vc_month()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.json")
+        with open(legacy_path, "w") as f:
+            json.dump(response, f)
+        stem = os.path.join(tmp, "month")
+        cache.save_vc(stem, response)
+
+        def legacy() -> Any:
+            with open(legacy_path) as f:
+                days = json.loads(f.read())["days"]
+            return [day["tempmax"] for day in days], [day["precip"] for day in days]
+
+        def raw_orjson() -> Any:
+            with open(legacy_path, "rb") as f:
+                return cache.project_vc(orjson.loads(f.read()))
+
+        results["legacy"] = timed("json.loads full response", legacy, n)
+        results["raw_orjson"] = timed("orjson.loads full response", raw_orjson, n)
+        results["projection"] = timed(
+            "cache.load_vc (projection)", lambda: cache.load_vc(stem), n
+        )
+        print(
+            f"{'sizes (bytes)':<40} legacy {os.path.getsize(legacy_path)},"
+            f" gz {os.path.getsize(stem + '.json.gz')},"
+            f" projection {os.path.getsize(stem + '.days.json')}"
+        )
+    return results
+
+
+def fixture_data(n_locations: int, years: int = 10, months: int = 3) -> List[Data]:
+    """Random (but seeded) Data for n_locations, shaped like a meteostat build."""
+    rng = random.Random(0)
+    return [
+        (
+            f"Location {i}",
+            [
+                (
+                    2000 + y,
+                    [
+                        (
+                            m + 1,
+                            {
+                                "tempmax": [rng.uniform(30, 105) for _ in range(30)],
+                                "tempmin": [rng.uniform(10, 70) for _ in range(30)],
+                                "precip": [
+                                    rng.choice([0.0, 0.0, 0.2, 1.1]) for _ in range(30)
+                                ],
+                            },
+                        )
+                        for m in range(months)
+                    ],
+                )
+                for y in range(years)
+            ],
+        )
+        for i in range(n_locations)
+    ]
+
+
+def bench_render(n_locations: int = 200) -> Dict[str, float]:
+    """Locations rendered per second, serially and over a process pool."""
+    import main  # pulls in pandas, meteostat, etc.
+
+    print(f"Render {n_locations} locations x 10 years")
+    datas = fixture_data(n_locations)
+    results = {}
+    worker_counts = sorted({1, 2, os.cpu_count() or 1})
+    for workers in worker_counts:
+        start = time.perf_counter()
+        main.render_all(datas, workers=workers)
+        per_second = n_locations / (time.perf_counter() - start)
+        results[f"workers_{workers}"] = per_second
+        speedup = per_second / results["workers_1"]
+        print(f"{f'{workers} worker(s)':<40} {per_second:9.1f} loc/s  ({speedup:.1f}x)")
+    return results
+
+
+def bench_templates(n_locations: int = 50, n: int = 20) -> Dict[str, float]:
+    """Page template: compiled every call (the old way) vs. the cached environment.
+    Fragments: render_data's f-strings vs. one batched bars.html call."""
+    from jinja2 import Template
+    from markupsafe import Markup
+    from mbforbes_python_utils import read
+
+    import main
+    import pages
+
+    print("Templates")
+    results = {}
+    content = Markup("<div></div>" * 1000)
+    results["page_compile"] = timed(
+        "main.html, Template(read(...))",
+        lambda: Template(read("templates/main.html")).render(content=content),
+        n,
+    )
+    results["page_env"] = timed(
+        "main.html, pages.render",
+        lambda: pages.render("main.html", content=content),
+        n,
+    )
+    datas = fixture_data(n_locations, years=3)
+    results["fragments_fstring"] = timed(
+        f"{n_locations} locations, f-strings",
+        lambda: [main.render_data(full_data) for full_data in datas],
+        n,
+    )
+    results["fragments_template"] = timed(
+        f"{n_locations} locations, bars.html batch",
+        lambda: pages.render_bars(datas),
+        n,
+    )
+    return results
+
+
+# the suite's page: locations x years x months, all fetched from the stub
+SUITE_YEARS = [2018, 2019, 2020, 2021, 2022]
+SUITE_MONTHS = [2, 3]
+
+# result -> worst acceptable value: a floor for rates (*_per_s), a ceiling for
+# peak memory (*_mb, traced Python allocations)
+BUDGETS = {
+    "cold_build_months_per_s": 15,
+    "warm_build_months_per_s": 30,
+    "render_locations_per_s": 200,
+    "cold_build_peak_mb": 40,
+    "warm_build_peak_mb": 40,
+    "render_peak_mb": 24,
+    "ms_cold_build_months_per_s": 15,
+    "ms_warm_build_months_per_s": 30,
+    "ms_cold_build_peak_mb": 40,
+    "ms_warm_build_peak_mb": 40,
+}
+
+HISTORY_PATH = "output/bench-history.jsonl"
+
+# a result regresses when it's this much worse than the median of the last
+# HISTORY_RUNS runs (of the same size)
+REGRESSION = 0.25
+HISTORY_RUNS = 5
+
+# rates are from the fastest of this many runs, as one run is noisy
+TIMED_RUNS = 3
+
+# cache dirs a cold run starts without
+SCRATCH_DIRS = ["cache/objects", "cache/archive", "cache/stats", "cache/locks"]
+
+
+@contextmanager
+def stub_vc() -> Iterator[Tuple[str, List[str]]]:
+    """Local HTTP stand-in for Visual Crossing's timeline API, answering any
+    /<lat>,<lon>/<start>/<end> with fixture_vc_month, in the requested unitGroup.
+    Yields (base url, paths requested so far)."""
+    bodies = {
+        (unit_group, n): orjson.dumps(fixture_vc_month(n, unit_group))
+        for unit_group in ["us", "metric"]
+        for n in range(28, 32)
+    }
+    requested: List[str] = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            path = url.path
+            requested.append(path)
+            start, end = path.split("/")[-2:]
+            n_days = (date.fromisoformat(end) - date.fromisoformat(start)).days + 1
+            unit_group = parse_qs(url.query).get("unitGroup", ["us"])[0]
+            body = bodies[(unit_group, n_days)]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{httpd.server_address[1]}/timeline", requested
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def fixture_ms_month(start: datetime, end: datetime) -> Any:
+    """A month as meteostat's Daily(...).fetch() gives it: a row per day, indexed by
+    time, metric columns (two days missing entirely, and one tmax)."""
+    from main import pd  # only when main (which pulls pandas in) is
+
+    days = pd.date_range(start, end, name="time")
+    n = len(days)
+    data = pd.DataFrame(
+        {
+            "tavg": np.linspace(8.0, 14.0, n),
+            "tmin": np.linspace(3.0, 9.0, n),
+            "tmax": np.linspace(12.0, 20.0, n),
+            "prcp": np.arange(n) % 4 * 1.5,
+            "snow": np.nan,
+            "wdir": 180.0,
+            "wspd": 11.2,
+            "wpgt": np.nan,
+            "pres": 1013.2,
+            "tsun": np.nan,
+        },
+        index=days,
+    )
+    data.loc[days[5], "tmax"] = np.nan
+    return data.drop(days[[10, 11]])
+
+
+@contextmanager
+def stub_ms(main: Any) -> Iterator[List[str]]:
+    """Swaps main's meteostat Daily for one answering with fixture_ms_month. Yields
+    the months requested so far."""
+    requested: List[str] = []
+    real = main.Daily
+
+    class Daily:
+        def __init__(self, point: Any, start: datetime, end: datetime):
+            self.start, self.end = start, end
+
+        def fetch(self) -> Any:
+            requested.append(self.start.date().isoformat())
+            return fixture_ms_month(self.start, self.end)
+
+    main.Daily = Daily
+    try:
+        yield requested
+    finally:
+        main.Daily = real
+
+
+@contextmanager
+def workspace() -> Iterator[None]:
+    """Runs in a scratch directory (with templates/ and a fake API key), so the
+    real cache is never read or written."""
+    here = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ["templates", "static"]:
+            os.symlink(os.path.join(here, name), os.path.join(tmp, name))
+        os.makedirs(os.path.join(tmp, "secrets"))
+        with open(os.path.join(tmp, "secrets/visualcrossing_api_key.txt"), "w") as f:
+            f.write("bench")
+        os.chdir(tmp)
+        try:
+            yield
+        finally:
+            os.chdir(here)
+
+
+def fresh(main: Any, keep_disk: bool):
+    """Forgets everything main has in memory, and (unless keep_disk) on disk."""
+    if not keep_disk:
+        for path in SCRATCH_DIRS:
+            shutil.rmtree(path, ignore_errors=True)
+    main.STORE = cache.Store()
+    main.ARCHIVES = archive.Archives()
+    main.MONTH_CACHE = cache.LRU(maxsize=main.MONTH_CACHE.maxsize)
+
+
+def measure(setup: Callable[[], Any], run: Callable[[], Any]) -> Tuple[float, float]:
+    """(best seconds, peak traced MB) of run, after setup. Timed and traced
+    separately, as tracing slows everything down."""
+    with redirect_stdout(io.StringIO()):
+        times = []
+        for _ in range(TIMED_RUNS):
+            setup()
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        setup()
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return min(times), peak / 2**20
+
+
+def run_suite(n_locations: int = 10) -> Dict[str, float]:
+    """Cold build, warm build and render-only, of n_locations VC locations, and
+    cold and warm builds of them from meteostat (results prefixed ms_)."""
+    import main
+
+    locations = [(f"Bench {i}", SUITE_MONTHS) for i in range(n_locations)]
+    # known coordinates, so nothing is geocoded
+    lc = {name: (10 + i * 0.5, 20.0) for i, (name, _) in enumerate(locations)}
+    n_months = n_locations * len(SUITE_YEARS) * len(SUITE_MONTHS)
+    results: Dict[str, float] = {}
+    with stub_vc() as (url, requested), stub_ms(main) as ms_requested, workspace():
+        main.VC_BASE_URL = url
+
+        def build(offline: bool = False, provider: str = "vc"):
+            main.build_page(
+                provider,
+                lc,
+                locations,
+                "bench.html",
+                offline=offline,
+                years=SUITE_YEARS,
+            )
+
+        def cold():
+            fresh(main, keep_disk=False)
+            requested.clear()
+            ms_requested.clear()
+
+        def ms_warm():
+            cold()
+            build(provider="ms")
+            fresh(main, keep_disk=True)
+
+        def warm():
+            cold()
+            build()
+            fresh(main, keep_disk=True)
+
+        datas: List[Data] = []
+
+        def loaded():
+            warm()
+            datas[:] = [
+                main.get_data("vc", lc, name, months, SUITE_YEARS, offline=True)
+                for name, months in locations
+            ]
+
+        def cold_build(provider: str = "vc"):
+            build(provider=provider)
+            # every month fetched once, through the stub
+            n = len(requested if provider == "vc" else ms_requested)
+            assert n == n_months, f"{n} of {n_months}"
+
+        for name, setup, run, n, unit in [
+            ("cold_build", cold, cold_build, n_months, "months"),
+            ("warm_build", warm, lambda: build(offline=True), n_months, "months"),
+            (
+                "ms_cold_build",
+                cold,
+                lambda: cold_build("ms"),
+                n_months,
+                "months",
+            ),
+            (
+                "ms_warm_build",
+                ms_warm,
+                lambda: build(offline=True, provider="ms"),
+                n_months,
+                "months",
+            ),
+            (
+                "render",
+                loaded,
+                lambda: main.render_page(datas),
+                n_locations,
+                "locations",
+            ),
+        ]:
+            seconds, peak_mb = measure(setup, run)
+            results[f"{name}_{unit}_per_s"] = n / seconds
+            results[f"{name}_peak_mb"] = peak_mb
+    return results
+
+
+def read_history(n_locations: int, path: str = HISTORY_PATH) -> List[Dict[str, Any]]:
+    """Past passing runs of the suite with n_locations, oldest first."""
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        runs = [orjson.loads(line) for line in f if line.strip()]
+    return [run for run in runs if run["locations"] == n_locations and run["ok"]]
+
+
+def check(results: Dict[str, float], history: List[Dict[str, Any]]) -> List[str]:
+    """Prints each result against its budget and recent runs. Returns problems."""
+    problems = []
+    print(f"{'':<32} {'result':>9} {'budget':>9} {'recent':>9}")
+    for name, value in results.items():
+        higher_is_better = name.endswith("_per_s")
+
+        def worse(a: float, b: float) -> bool:
+            return a < b if higher_is_better else a > b
+
+        budget = BUDGETS.get(name)
+        previous = [
+            run["results"][name]
+            for run in history[-HISTORY_RUNS:]
+            if name in run["results"]
+        ]
+        baseline = statistics.median(previous) if len(previous) > 0 else None
+        flags = []
+        if budget is not None and worse(value, budget):
+            flags.append("misses budget")
+        if baseline is not None:
+            change = value / baseline - 1
+            if worse(change, -REGRESSION if higher_is_better else REGRESSION):
+                flags.append(f"regressed {change:+.0%}")
+        problems += [f"{name}: {flag}" for flag in flags]
+        print(
+            f"{name:<32} {value:9.1f} {budget or float('nan'):9.1f}"
+            f" {baseline or float('nan'):9.1f}  {', '.join(flags)}"
+        )
+    return problems
+
+
+def record(
+    results: Dict[str, float], n_locations: int, ok: bool, path: str = HISTORY_PATH
+):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    run = {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "locations": n_locations,
+        "ok": ok,
+    }
+    with open(path, "ab") as f:
+        f.write(orjson.dumps({**run, "results": results}) + b"\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="bench.py")
+    parser.add_argument(
+        "--check", action="store_true", help="run the budgeted suite instead"
+    )
+    parser.add_argument("--locations", type=int, default=10, help="with --check")
+    args = parser.parse_args()
+    if args.check:
+        results = run_suite(args.locations)
+        problems = check(results, read_history(args.locations))
+        record(results, args.locations, len(problems) == 0)
+        if len(problems) > 0:
+            sys.exit("\n".join(problems))
+    else:
+        bench_vc_decode()
+        bench_render()
+        bench_templates()
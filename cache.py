@@ -0,0 +1,444 @@
+"""On-disk cache helpers.
+
+Everything fetched lives in a content-addressed store (see Store): each cache entry
+is named by a hash of what it holds (provider, location, date range), under
+cache/objects/, with a manifest.json saying what each key is.
+
+Visual Crossing responses are kept twice per month:
+
+- `<stem>.json.gz`: the full raw response, gzipped (see doc/response.py for shape)
+- `<stem>.days.json`: a compact projection of just the per-day numbers, by metric,
+  in metric units (see units.CANONICAL) whatever unitGroup the response was in
+
+Warm reads only ever touch the projection. Reads go through orjson, which is a
+good deal faster than json for the (big) raw responses.
+
+meteostat months are `<stem>.csv`, as returned by Daily(...).fetch().
+"""
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import date
+import fcntl
+import gzip
+import hashlib
+import os
+import shutil
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+import orjson
+
+import units
+
+
+class CacheMiss(Exception):
+    """Raised instead of fetching, when only cached data may be used."""
+
+
+# bump whenever the projection's contents change; stale projections are rebuilt
+# from the raw response.
+VC_PROJECTION_VERSION = 3
+
+# every numeric per-day field in doc/response.py
+VC_METRICS = [
+    "tempmax",
+    "tempmin",
+    "temp",
+    "feelslikemax",
+    "feelslikemin",
+    "feelslike",
+    "dew",
+    "humidity",
+    "precip",
+    "precipprob",
+    "precipcover",
+    "snow",
+    "snowdepth",
+    "windgust",
+    "windspeed",
+    "winddir",
+    "pressure",
+    "cloudcover",
+    "visibility",
+    "solarradiation",
+    "solarenergy",
+    "uvindex",
+    "moonphase",
+]
+
+
+def project_vc(response: Dict[str, Any]) -> Dict[str, List[float]]:
+    """Pulls the numeric fields out of a raw VC response, one list per metric.
+
+    Responses without a "unitGroup" (saved before we asked for metric) are "us".
+    """
+    days = {
+        metric: [day.get(metric) for day in response["days"]] for metric in VC_METRICS
+    }
+    if response.get("unitGroup", "us") == "us":
+        for metric, values in days.items():
+            if metric not in units.TO_IMPERIAL:
+                continue
+            converted = units.from_imperial(np.array(values, dtype=float), metric)
+            days[metric] = [
+                None if value != value else value
+                for value in np.round(converted, units.CANONICAL_DECIMALS).tolist()
+            ]
+    return days
+
+
+def save_vc(stem: str, response: Dict[str, Any]) -> Dict[str, List[float]]:
+    """Writes the raw response (gzipped) and its projection. Returns projection."""
+    write_atomic(stem + ".json.gz", gzip.compress(orjson.dumps(response)))
+    return _save_vc_projection(stem, response)
+
+
+def _save_vc_projection(stem: str, response: Dict[str, Any]) -> Dict[str, List[float]]:
+    days = project_vc(response)
+    write_atomic(
+        stem + ".days.json",
+        orjson.dumps({"version": VC_PROJECTION_VERSION, "days": days}),
+    )
+    return days
+
+
+def load_vc(
+    stem: str,
+    write_stem: Optional[str] = None,
+    exists: Callable[[str], bool] = os.path.exists,
+) -> Optional[Dict[str, List[float]]]:
+    """Returns the cached projection for `stem`, or None on a miss.
+
+    Falls back to (and upgrades) the raw gzipped response, or the old
+    uncompressed `<stem>.json` format. Upgrades are written to `write_stem`
+    (default: `stem`), so `stem` can be in a read-only shared cache. `exists`
+    checks for each of those files, e.g., Store.exists to use its index.
+    """
+    write_stem = write_stem or stem
+    projection_path = stem + ".days.json"
+    if exists(projection_path):
+        with open(projection_path, "rb") as f:
+            projection = orjson.loads(f.read())
+        if projection.get("version") == VC_PROJECTION_VERSION:
+            return projection["days"]
+
+    raw_path = stem + ".json.gz"
+    if exists(raw_path):
+        with gzip.open(raw_path, "rb") as f:
+            return _save_vc_projection(write_stem, orjson.loads(f.read()))
+
+    legacy_path = stem + ".json"
+    if exists(legacy_path):
+        print("Compressing old cache file", legacy_path)
+        with open(legacy_path, "rb") as f:
+            days = save_vc(write_stem, orjson.loads(f.read()))
+        if write_stem == stem:
+            os.remove(legacy_path)
+        return days
+
+    return None
+
+
+# cache/objects/ and cache/locations.json are what's worth sharing between machines
+CACHE_ROOT = "cache"
+
+# extra cache roots to read from (never written), separated by os.pathsep
+SHARED_CACHE_ENV = "WEATHERSPREAD_SHARED_CACHE"
+
+
+class Store:
+    """Content-addressed cache layout.
+
+    An entry's key is a hash of (provider, grid cell, start, end); its files are
+    <root>/objects/<key[:2]>/<key>.<ext>. Since names only depend on contents,
+    roots can be rsynced, mounted read-only, or merged without conflicts.
+
+    Reads check the local root first, then each shared root. Writes only ever go
+    to the local root (the overlay), which also keeps a manifest.json of
+    {key: {"provider", "cell", "name", "start", "end"}}. The cell (see
+    dataset.grid_cell) is what's keyed on, so every name for one place shares an
+    entry; name is whichever one fetched it.
+
+    After scan(), lookups use an in-memory index of every root's files instead of
+    checking each file exists, which is most of a warm build's time on network
+    filesystems. Files written since (e.g., fetches) aren't in it, so lookups that
+    miss the index still check the disk.
+    """
+
+    def __init__(self, root: str = CACHE_ROOT, shared_roots: List[str] = []):
+        self.root = root
+        self.shared_roots = shared_roots
+        self.manifest_path = os.path.join(root, "objects", "manifest.json")
+        self.manifest = read_manifest(self.manifest_path)
+        self.lock = threading.Lock()
+        # "<key><ext>" -> path in the first root that has it; see scan()
+        self.index: Optional[Dict[str, str]] = None
+
+    def scan(self) -> int:
+        """Lists every root's objects/ once, into the index. Returns its size."""
+        index: Dict[str, str] = {}
+        for root in [self.root] + self.shared_roots:
+            objects = os.path.join(root, "objects")
+            if not os.path.isdir(objects):
+                continue
+            with os.scandir(objects) as shards:
+                for shard in shards:
+                    if not shard.is_dir():
+                        continue
+                    with os.scandir(shard.path) as files:
+                        for f in files:
+                            index.setdefault(f.name, f.path)
+        self.index = index
+        return len(index)
+
+    @staticmethod
+    def key(provider: str, cell: str, start: date, end: date) -> str:
+        ident = "|".join([provider, cell, start.isoformat(), end.isoformat()])
+        return hashlib.sha256(ident.encode()).hexdigest()[:32]
+
+    def lock_path(self, key: str) -> str:
+        """Held while key is being fetched; see file_lock."""
+        return os.path.join(self.root, "locks", key + ".lock")
+
+    def local_stem(self, key: str) -> str:
+        return os.path.join(self.root, "objects", key[:2], key)
+
+    def stems(self, key: str, exts: List[str] = []) -> List[str]:
+        """Where key's files might be, local first. With exts, and an index that
+        has any of them, only the stems that have one."""
+        stems = [
+            os.path.join(root, "objects", key[:2], key)
+            for root in [self.root] + self.shared_roots
+        ]
+        if self.index is not None:
+            indexed = {
+                self.index[key + ext][: -len(ext)]
+                for ext in exts
+                if key + ext in self.index
+            }
+            if len(indexed) > 0:
+                return [stem for stem in stems if stem in indexed]
+        return stems
+
+    def exists(self, path: str) -> bool:
+        """Whether the file at path (under one of the roots) exists; from the index
+        if it has it."""
+        if self.index is not None and self.index.get(os.path.basename(path)) == path:
+            return True
+        return os.path.exists(path)
+
+    def find(self, key: str, ext: str) -> Optional[str]:
+        """Path of key's `ext` file in the first root that has it, or None."""
+        if self.index is not None and key + ext in self.index:
+            return self.index[key + ext]
+        for stem in self.stems(key):
+            if os.path.exists(stem + ext):
+                return stem + ext
+        return None
+
+    def record(
+        self, key: str, provider: str, cell: str, name: str, start: date, end: date
+    ):
+        """Notes in the local manifest what key holds."""
+        entry = {
+            "provider": provider,
+            "cell": cell,
+            "name": name,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+        }
+        if self.manifest.get(key) == entry:
+            return
+
+        def change(manifest: Dict[str, Dict[str, str]]):
+            manifest[key] = entry
+
+        self.update_manifest(change)
+
+    def update_manifest(self, change: Callable[[Dict[str, Dict[str, str]]], None]):
+        """Applies change to the manifest as it is on disk, as other processes may
+        have changed it since we read it, and writes it back, all under its lock."""
+        with self.lock, file_lock(self.manifest_path + ".lock"):
+            manifest = read_manifest(self.manifest_path)
+            change(manifest)
+            write_manifest(self.manifest_path, manifest)
+            self.manifest = manifest
+
+    def rekey(self, old_key: str, new_key: str, entry: Dict[str, str]):
+        """Moves a local entry's files to new_key. If new_key already has files (an
+        alias of the same place was fetched too), old_key's are just dropped."""
+        old_stem, new_stem = self.local_stem(old_key), self.local_stem(new_key)
+        old_dir = os.path.dirname(old_stem)
+        names = (
+            [n for n in os.listdir(old_dir) if n.startswith(old_key + ".")]
+            if os.path.isdir(old_dir)
+            else []
+        )
+        exts = [name[len(old_key) :] for name in names]
+        duplicate = any(os.path.exists(new_stem + ext) for ext in exts)
+        os.makedirs(os.path.dirname(new_stem), exist_ok=True)
+        for ext in exts:
+            if duplicate:
+                os.remove(old_stem + ext)
+            else:
+                os.replace(old_stem + ext, new_stem + ext)
+
+        def change(manifest: Dict[str, Dict[str, str]]):
+            manifest.pop(old_key, None)
+            manifest.setdefault(new_key, entry)
+
+        self.update_manifest(change)
+        self.index = None
+
+    def merge(self, src_root: str) -> int:
+        """Copies entries from another cache root that we don't have yet.
+
+        Returns how many were copied.
+        """
+        src_manifest = read_manifest(os.path.join(src_root, "objects", "manifest.json"))
+        copied: Dict[str, Dict[str, str]] = {}
+        for key, entry in src_manifest.items():
+            src_dir = os.path.join(src_root, "objects", key[:2])
+            dst_dir = os.path.dirname(self.local_stem(key))
+            if not os.path.isdir(src_dir):
+                continue
+            names = [n for n in os.listdir(src_dir) if n.startswith(key + ".")]
+            missing = [n for n in names if not os.path.exists(os.path.join(dst_dir, n))]
+            if len(missing) == 0:
+                continue
+            os.makedirs(dst_dir, exist_ok=True)
+            for name in missing:
+                # copy then rename, so a half-copied file is never visible
+                tmp_path = os.path.join(dst_dir, f".{name}.tmp")
+                shutil.copy2(os.path.join(src_dir, name), tmp_path)
+                os.replace(tmp_path, os.path.join(dst_dir, name))
+            copied[key] = entry
+        self.update_manifest(lambda manifest: manifest.update(copied))
+        self.index = None
+        return len(copied)
+
+
+def read_manifest(path: str) -> Dict[str, Dict[str, str]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+
+def write_manifest(path: str, manifest: Dict[str, Dict[str, str]]):
+    write_atomic(path, orjson.dumps(manifest, option=orjson.OPT_SORT_KEYS))
+
+
+def write_atomic(path: str, contents: bytes):
+    """Readers (in any process) see the old file or the new one, never half of it."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(contents)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def file_lock(path: str):
+    """Holds an exclusive lock on path (created if needed) across processes."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key: the first caller runs fn, and
+    everyone who asks for that key while it's running waits for its result (or
+    exception) instead of running it again."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self.lock:
+            in_flight = self.flights.get(key)
+            if in_flight is None:
+                future: Future = Future()
+                self.flights[key] = future
+        if in_flight is not None:
+            return in_flight.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.flights[key]
+
+
+def shared_roots_from_env() -> List[str]:
+    value = os.environ.get(SHARED_CACHE_ENV, "")
+    return [root for root in value.split(os.pathsep) if root]
+
+
+class LRU:
+    """Size-bounded in-memory cache; least recently used entries go first.
+
+    Thread-safe. Counts hits and misses (see stats()).
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        """Returns the value for key, or None."""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups > 0 else 0
+        return (
+            f"{self.hits} hits, {self.misses} misses ({rate:.0%} hit rate),"
+            f" {len(self)}/{self.maxsize} entries"
+        )
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def adopt(old_stem: str, new_stem: str, exts: List[str]) -> bool:
+    """Moves old_stem's files (from an older cache layout) to new_stem.
+
+    Returns whether there was anything to move.
+    """
+    moved = False
+    for ext in exts:
+        if os.path.exists(old_stem + ext):
+            os.makedirs(os.path.dirname(new_stem), exist_ok=True)
+            os.replace(old_stem + ext, new_stem + ext)
+            moved = True
+    return moved
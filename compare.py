@@ -0,0 +1,114 @@
+"""Cross-location comparison: which places have the most "nice" days?
+
+A day is nice when it's not hot (temp <= hot) and not wet (precip < wet), in
+whatever units the data's in (see units.System's hot and wet). Missing
+days (NaN) aren't counted at all. The index
+holds per-location, per-month day counts (summed over years), so ranking any set
+of months is just adding a few ints per location.
+"""
+
+import calendar
+from html import escape
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dataset import DataView
+
+"""{"days": n, "hot": n, "wet": n, "nice": n}"""
+Summary = Dict[str, int]
+
+"""{location name: {month: Summary}}"""
+Index = Dict[str, Dict[int, Summary]]
+
+
+def empty_summary() -> Summary:
+    return {"days": 0, "hot": 0, "wet": 0, "nice": 0}
+
+
+def summarize(
+    full_data: DataView, key: str = "tempmax", hot: float = 90, wet: float = 0.1
+) -> Dict[int, Summary]:
+    """Per-month day counts for one location, summed over its years."""
+    _, all_data = full_data
+    by_month: Dict[int, Summary] = {}
+    for _, year_data in all_data:
+        for month, metrics in year_data:
+            summary = by_month.setdefault(month, empty_summary())
+            for temp, precip in zip(metrics[key], metrics["precip"]):
+                if math.isnan(temp) or math.isnan(precip):
+                    continue
+                is_hot, is_wet = temp > hot, precip >= wet
+                summary["days"] += 1
+                summary["hot"] += is_hot
+                summary["wet"] += is_wet
+                summary["nice"] += not (is_hot or is_wet)
+    return by_month
+
+
+def build_index(
+    datas: Iterable[DataView], key: str = "tempmax", hot: float = 90, wet: float = 0.1
+) -> Index:
+    return {full_data[0]: summarize(full_data, key, hot, wet) for full_data in datas}
+
+
+def rank(index: Index, months: Optional[List[int]] = None) -> List[Tuple[str, Summary]]:
+    """Locations with their totals over `months` (default: all), best first.
+
+    Best = highest fraction of nice days; ties go to fewer hot days.
+    """
+    totals = []
+    for location, by_month in index.items():
+        total = empty_summary()
+        for month, summary in by_month.items():
+            if months is not None and month not in months:
+                continue
+            for field, n in summary.items():
+                total[field] += n
+        if total["days"] > 0:
+            totals.append((location, total))
+    totals.sort(key=lambda lt: (-lt[1]["nice"] / lt[1]["days"], lt[1]["hot"]))
+    return totals
+
+
+def month_names(months: List[int]) -> str:
+    """E.g., [4, 5, 7] -> "Apr–May, Jul"."""
+    runs: List[List[int]] = []
+    for month in months:
+        if len(runs) > 0 and runs[-1][-1] + 1 == month:
+            runs[-1].append(month)
+        else:
+            runs.append([month])
+    return ", ".join(
+        "–".join(calendar.month_abbr[m] for m in sorted({run[0], run[-1]}))
+        for run in runs
+    )
+
+
+def render_ranking(
+    ranking: List[Tuple[str, Summary]],
+    months: Optional[List[int]] = None,
+    hot: float = 90,
+    wet: float = 0.1,
+    temp_unit: str = "°F",
+    precip_unit: str = "in",
+) -> str:
+    which = "all months" if months is None else month_names(months)
+    buf = []
+    buf.append(
+        f"<h3 class='gray'>Nice days (≤ {hot:g}{temp_unit}, &lt; {wet:g}{precip_unit} rain),"
+        f" {which}</h3>"
+    )
+    buf.append("<table class='collapse f6 mb4'>")
+    buf.append(
+        "<tr class='tl'><th class='pr3'>#</th><th class='pr3'>Location</th>"
+        "<th class='pr3'>Nice</th><th class='pr3'>Hot</th><th class='pr3'>Wet</th></tr>"
+    )
+    for i, (location, total) in enumerate(ranking):
+        pct = round(100 * total["nice"] / total["days"])
+        buf.append(
+            f"<tr><td class='pr3'>{i + 1}</td><td class='pr3'>{escape(location)}</td>"
+            f"<td class='pr3'>{pct}%</td><td class='pr3'>{total['hot']}</td>"
+            f"<td class='pr3'>{total['wet']}</td></tr>"
+        )
+    buf.append("</table>")
+    return "\n".join(buf)
@@ -0,0 +1,145 @@
+"""Keeps caches warm: on a schedule, fetches months that aren't cached yet (e.g.,
+ones that just finished), then pre-renders, so interactive builds never wait on
+the network.
+
+Progress goes to a status file (see Status), rewritten after every fetch:
+
+    watch -n 5 cat output/daemon-status.json
+"""
+
+from datetime import datetime
+import json
+import os
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+STATUS_PATH = "output/daemon-status.json"
+
+# (provider, location, what to fetch)
+Job = Tuple[str, str, Any]
+
+
+class RateLimiter:
+    """At most one call per `min_interval` seconds, across threads."""
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.min_interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Status:
+    """What the daemon's doing, mirrored to a JSON file on every change."""
+
+    def __init__(self, path: str = STATUS_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fields: Dict[str, Any] = {
+            "started": now_iso(),
+            "state": "starting",
+            "cycles": 0,
+            "fetched": 0,
+            "failed": 0,
+            "pending": 0,
+            "last_cycle": None,
+            "next_cycle": None,
+            "errors": [],
+        }
+
+    def update(self, **fields: Any):
+        with self.lock:
+            self.fields.update(fields)
+            self._write()
+
+    def add(self, field: str, n: int = 1):
+        with self.lock:
+            self.fields[field] += n
+            self._write()
+
+    def error(self, job: Job, e: Exception):
+        with self.lock:
+            self.fields["failed"] += 1
+            # just the recent ones
+            self.fields["errors"] = self.fields["errors"][-19:] + [
+                {
+                    "time": now_iso(),
+                    "job": [str(part) for part in job],
+                    "error": repr(e),
+                }
+            ]
+            self._write()
+
+    def _write(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.fields, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def now_iso() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def run(
+    due: Callable[[], List[Job]],
+    fetch: Callable[[Job], None],
+    prerender: Callable[[], Dict[str, Any]],
+    min_intervals: Dict[str, float],
+    interval: float = 6 * 60 * 60,
+    status: Optional[Status] = None,
+    cycles: Optional[int] = None,
+):
+    """Blocks, running a cycle every `interval` seconds (or `cycles` times).
+
+    A cycle fetches every job due() returns, each provider no faster than its
+    min_intervals entry, then calls prerender(), whose return value (e.g., cache
+    stats) goes in the status. A failed job is logged and retried next cycle.
+    """
+    status = status or Status()
+    limiters = {provider: RateLimiter(s) for provider, s in min_intervals.items()}
+    n = 0
+    while cycles is None or n < cycles:
+        start = time.time()
+        status.update(state="planning")
+        jobs = due()
+        status.update(state="fetching", pending=len(jobs))
+        for i, job in enumerate(jobs):
+            provider = job[0]
+            if provider in limiters:
+                limiters[provider].wait()
+            try:
+                fetch(job)
+                status.add("fetched")
+            except Exception as e:
+                traceback.print_exc()
+                status.error(job, e)
+            status.update(pending=len(jobs) - i - 1)
+        status.update(state="rendering")
+        rendered = prerender()
+        n += 1
+        next_start = start + interval
+        status.update(
+            state="sleeping",
+            cycles=n,
+            last_cycle={
+                "started": datetime.fromtimestamp(start).isoformat(timespec="seconds"),
+                "seconds": round(time.time() - start, 1),
+                "jobs": len(jobs),
+                **rendered,
+            },
+            next_cycle=datetime.fromtimestamp(next_start).isoformat(timespec="seconds"),
+        )
+        print(f"Daemon: cycle {n} done, {len(jobs)} fetches")
+        if cycles is None or n < cycles:
+            time.sleep(max(0.0, next_start - time.time()))
@@ -0,0 +1,90 @@
+"""Shared data types.
+
+Metric names follow Visual Crossing's daily record (see doc/response.py); meteostat
+columns are renamed to match (see main.MS_METRICS).
+"""
+
+from array import array
+import hashlib
+from itertools import repeat
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+)
+import unicodedata
+
+import numpy as np
+
+"""A metric's days: a list, or an array (e.g., a slice of an archive.py memmap)"""
+Values = Union[Sequence[float], np.ndarray]
+
+"""A metric's provenance: a SOURCE_* per day"""
+Sources = Sequence[int]
+
+"""{metric name: [day1, day2, ...]}, e.g., {"tempmax": [...], "precip": [...]}"""
+Metrics = Dict[str, Union[Values, Sources]]
+
+# Missing days are NaN. Each metric also has a "<metric>_source" list (Sources)
+# saying where each day's value came from:
+SOURCE_OBSERVED = 0
+SOURCE_INTERPOLATED = 1  # short gap, interpolated from the days around it
+SOURCE_OTHER_PROVIDER = 2  # longer gap, filled from the other provider's cache
+SOURCE_MISSING = 3  # still NaN
+
+""" (location name, [(year, [(month, {metric: [day1, day2, ...]})])]"""
+Data = Tuple[str, List[Tuple[int, List[Tuple[int, Metrics]]]]]
+
+"""Data as main.pack sends it to worker processes: only the metrics that are drawn,
+values as array("d") and provenance as array("b")"""
+PackedMetrics = Dict[str, Union["array[float]", "array[int]"]]
+PackedData = Tuple[str, List[Tuple[int, List[Tuple[int, PackedMetrics]]]]]
+
+"""Read-only Data, which PackedData fits too. What renderers take."""
+MetricsView = Mapping[str, Union[Values, Sources]]
+DataView = Tuple[str, Sequence[Tuple[int, Sequence[Tuple[int, MetricsView]]]]]
+
+# format {"Display Name": [lat, lon], ...}
+LocationCache = Dict[str, Tuple[float, float]]
+
+# canonical locations snap to a grid this many degrees wide (~1km)
+GRID_DEGREES = 0.01
+
+
+def fingerprint(value: Any) -> str:
+    """Short content hash of value (e.g., Data); changes whenever its repr does."""
+    return hashlib.sha1(repr(value).encode()).hexdigest()[:16]
+
+
+def normalize_location(name: str) -> str:
+    """E.g., "  Tiranë,Albania " -> "tirane, albania"."""
+    ascii_name = (
+        unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    )
+    parts = [" ".join(part.split()) for part in ascii_name.lower().split(",")]
+    return ", ".join(part for part in parts if part)
+
+
+def grid_cell(lat: float, lon: float) -> str:
+    """Id of the grid cell containing (lat, lon), e.g., "41.32,19.82"."""
+    lat_cell = round(lat / GRID_DEGREES) * GRID_DEGREES
+    lon_cell = round(lon / GRID_DEGREES) * GRID_DEGREES
+    return f"{lat_cell:.2f},{lon_cell:.2f}"
+
+
+def source_key(metric: str) -> str:
+    """Metrics key of metric's provenance list."""
+    return metric + "_source"
+
+
+def day_sources(metrics: MetricsView, metric: str) -> Iterable[int]:
+    """metric's provenance; all SOURCE_OBSERVED if it has none (e.g., not filled)."""
+    if source_key(metric) not in metrics:
+        return repeat(SOURCE_OBSERVED)
+    return cast(Sources, metrics[source_key(metric)])
@@ -0,0 +1,76 @@
+"""Month planning: every month a build needs, worked out once up front.
+
+A MonthSpan carries what fetching, caching and rendering need to know about a
+month (ISO start and end, how many days, where its days sit in its year), so none
+of them re-derive it with calendar.monthrange or date strings.
+"""
+
+import calendar
+from datetime import date
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Tuple
+
+
+class MonthSpan(NamedTuple):
+    year: int
+    month: int
+    start: date
+    end: date  # inclusive
+    n_days: int
+    # index of start in its year's days, i.e., day of the year - 1
+    offset: int
+
+    def __str__(self) -> str:
+        return f"{self.year}-{self.month:02d}"
+
+    def iso(self) -> Tuple[str, str]:
+        """E.g., ("2020-02-01", "2020-02-29")."""
+        return self.start.isoformat(), self.end.isoformat()
+
+    def legacy(self) -> Tuple[str, str]:
+        """Unpadded, e.g., ("2020-2-01", "2020-2-29"), as in old cache file names."""
+        return f"{self.year}-{self.month}-01", f"{self.year}-{self.month}-{self.n_days}"
+
+
+@lru_cache(maxsize=None)
+def month_span(year: int, month: int) -> MonthSpan:
+    n_days = calendar.monthrange(year, month)[1]
+    start = date(year, month, 1)
+    return MonthSpan(
+        year,
+        month,
+        start,
+        date(year, month, n_days),
+        n_days,
+        start.timetuple().tm_yday - 1,
+    )
+
+
+def year_days(year: int) -> int:
+    return 366 if calendar.isleap(year) else 365
+
+
+def plan(
+    years: List[int], months: List[int], today: Optional[date] = None
+) -> List[MonthSpan]:
+    """Every finished (year, month), year by year, in the order given. A month that
+    hasn't ended by today isn't history yet, so it's never fetched or cached."""
+    today = today or date.today()
+    spans = [month_span(year, month) for year in years for month in months]
+    return [span for span in spans if span.end < today]
+
+
+def recent_years(back: int, today: Optional[date] = None) -> List[int]:
+    """This year and the `back` before it, oldest first."""
+    today = today or date.today()
+    return list(range(today.year - back, today.year + 1))
+
+
+def by_year(spans: List[MonthSpan]) -> List[Tuple[int, List[MonthSpan]]]:
+    """Groups a plan's spans by year, keeping their order."""
+    grouped: List[Tuple[int, List[MonthSpan]]] = []
+    for span in spans:
+        if len(grouped) == 0 or grouped[-1][0] != span.year:
+            grouped.append((span.year, []))
+        grouped[-1][1].append(span)
+    return grouped
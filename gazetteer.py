@@ -0,0 +1,203 @@
+"""Offline geocoding from a GeoNames cities dump, plus bulk location import/export.
+
+Build the gazetteer once from a GeoNames dump (e.g., cities15000.txt, unzipped from
+https://download.geonames.org/export/dump/):
+
+    python -c "import gazetteer; gazetteer.build('cities15000.txt')"
+
+If countryInfo.txt and admin1CodesASCII.txt (from the same page) are next to the
+dump, places can be qualified by country and state/province names, e.g.,
+"Birmingham, Alabama"; otherwise only by their codes ("Birmingham, US").
+
+That writes cache/gazetteer-v2.tsv: one "name\\tlat\\tlon\\tqualifiers" line per
+normalized place name and place, sorted by name (then most populous first), where
+qualifiers are the place's country and admin1 codes and names, "|"-separated.
+Lookups memory-map the file and binary search it, so it's never parsed into Python
+objects, and opening it is instant however big it is.
+"""
+
+import csv
+import difflib
+import json
+import mmap
+import os
+from typing import Dict, List, Optional, Tuple
+
+from dataset import LocationCache, normalize_location
+
+GAZETTEER_PATH = "cache/gazetteer-v2.tsv"
+
+# GeoNames columns (see the dump's readme.txt)
+GN_NAME, GN_ASCIINAME, GN_LAT, GN_LON = 1, 2, 4, 5
+GN_COUNTRY, GN_ADMIN1, GN_POPULATION = 8, 10, 14
+
+
+def _read_names(path: str, names: List[int]) -> Dict[str, List[str]]:
+    """{first column: [the `names` columns]} of a GeoNames table, or {} if the file
+    isn't there."""
+    if not os.path.exists(path):
+        return {}
+    table = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            cols = line.rstrip("\n").split("\t")
+            table[cols[0]] = [cols[i] for i in names]
+    return table
+
+
+def build(geonames_path: str, out_path: str = GAZETTEER_PATH):
+    """Writes the compact gazetteer from a GeoNames dump (and, if they're next to
+    it, its country and admin1 name tables)."""
+    here = os.path.dirname(geonames_path)
+    # code -> [ISO3 code, name]; "US.AL" -> [ascii name]
+    countries = _read_names(os.path.join(here, "countryInfo.txt"), [1, 4])
+    admin1s = _read_names(os.path.join(here, "admin1CodesASCII.txt"), [2])
+    places: List[Tuple[str, int, str, str, str]] = []
+    with open(geonames_path, encoding="utf-8") as f:
+        for line in f:
+            cols = line.rstrip("\n").split("\t")
+            country, admin1 = cols[GN_COUNTRY], cols[GN_ADMIN1]
+            within = [
+                country,
+                *countries.get(country, []),
+                *admin1s.get(f"{country}.{admin1}", []),
+            ]
+            # e.g., US states' postal codes; most countries' are just numbers
+            if admin1.isalpha():
+                within.append(admin1)
+            qualifiers = "|".join(
+                sorted({normalize_location(q) for q in within} - {""})
+            )
+            population = int(cols[GN_POPULATION] or 0)
+            for name in {
+                normalize_location(cols[GN_NAME]),
+                normalize_location(cols[GN_ASCIINAME]),
+            }:
+                if name:
+                    places.append(
+                        (name, -population, cols[GN_LAT], cols[GN_LON], qualifiers)
+                    )
+    places.sort(key=lambda place: (place[0].encode(), place[1]))
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "wb") as f:
+        for name, _, lat, lon, qualifiers in places:
+            f.write(f"{name}\t{lat}\t{lon}\t{qualifiers}\n".encode())
+    print(f"Wrote {len(places)} place names to {out_path}")
+
+
+class Gazetteer:
+    """Place name -> (lat, lon) over a memory-mapped gazetteer file (see build())."""
+
+    def __init__(self, path: str = GAZETTEER_PATH):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.names: Optional[List[str]] = None
+
+    def _places(self, name: str) -> List[Tuple[Tuple[float, float], List[str]]]:
+        """((lat, lon), qualifiers) of every place called name, most populous first."""
+        target = name.encode()
+        mm = self.mm
+        # binary search over line starts. lo only ever lands on a line start.
+        lo, hi = 0, len(mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = mm.rfind(b"\n", 0, mid) + 1
+            end = mm.find(b"\n", mid)
+            end = len(mm) if end == -1 else end
+            if mm[start : mm.find(b"\t", start)] < target:
+                lo = end + 1
+            else:
+                hi = start
+        places = []
+        while lo < len(mm):
+            end = mm.find(b"\n", lo)
+            end = len(mm) if end == -1 else end
+            cols = mm[lo:end].split(b"\t")
+            if cols[0] != target:
+                break
+            places.append(
+                ((float(cols[1]), float(cols[2])), cols[3].decode().split("|"))
+            )
+            lo = end + 1
+        return places
+
+    def _resolve(
+        self, city: str, qualifiers: List[str]
+    ) -> Optional[Tuple[float, float]]:
+        """The one place called city that's in every qualifier, else None."""
+        matches = [
+            latlon
+            for latlon, within in self._places(city)
+            if all(q in within for q in qualifiers)
+        ]
+        return matches[0] if len(matches) == 1 else None
+
+    def _fuzzy(self, name: str) -> Optional[str]:
+        if self.names is None:
+            self.mm.seek(0)
+            self.names = list(
+                dict.fromkeys(
+                    line.split(b"\t", 1)[0].decode()
+                    for line in iter(self.mm.readline, b"")
+                )
+            )
+        matches = difflib.get_close_matches(name, self.names, n=1, cutoff=0.8)
+        return matches[0] if len(matches) > 0 else None
+
+    def lookup(self, display_name: str) -> Optional[Tuple[float, float]]:
+        """The city ("Córdoba" of "Córdoba, Spain") in each of the qualifiers after
+        it (country or admin1 names or codes), if exactly one place is; if no place
+        has the city's name, the closest fuzzy match for it, by the same rule.
+
+        None if that's ambiguous ("Birmingham" alone) or nothing matches, so the
+        caller can ask Nominatim instead."""
+        city, *qualifiers = normalize_location(display_name).split(", ")
+        if len(self._places(city)) > 0:
+            return self._resolve(city, qualifiers)
+        match = self._fuzzy(city)
+        if match is None:
+            return None
+        latlon = self._resolve(match, qualifiers)
+        if latlon is not None:
+            print(f'Gazetteer: using "{match}" for "{display_name}"')
+        return latlon
+
+
+def open_default() -> Optional[Gazetteer]:
+    """The gazetteer at GAZETTEER_PATH, or None if it hasn't been built."""
+    return Gazetteer() if os.path.exists(GAZETTEER_PATH) else None
+
+
+def export_locations(lc: LocationCache, path: str):
+    """Writes lc to path, as CSV (name,lat,lon) or JSON (by extension)."""
+    if path.endswith(".json"):
+        with open(path, "w") as f:
+            json.dump(lc, f, indent=2, ensure_ascii=False)
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "lat", "lon"])
+        for name, (lat, lon) in sorted(lc.items()):
+            writer.writerow([name, lat, lon])
+
+
+def import_locations(lc: LocationCache, path: str) -> int:
+    """Adds locations from a CSV (name,lat,lon) or JSON file to lc, overwriting
+    existing names. Returns how many were added or changed."""
+    if path.endswith(".json"):
+        with open(path) as f:
+            incoming = {name: (lat, lon) for name, (lat, lon) in json.load(f).items()}
+    else:
+        with open(path, newline="") as f:
+            incoming = {
+                row["name"]: (float(row["lat"]), float(row["lon"]))
+                for row in csv.DictReader(f)
+            }
+    changed = 0
+    for name, latlon in incoming.items():
+        if tuple(lc.get(name, ())) != latlon:
+            lc[name] = latlon
+            changed += 1
+    return changed
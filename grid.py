@@ -0,0 +1,112 @@
+"""Regional maps: sample a lat/lon bounding box on a grid, and draw a value per grid
+point as an SVG map.
+
+Nearby grid points usually end up using the same weather station, so points are
+snapped to their nearest station (found through a SpatialIndex) and each station
+is only fetched once; see main.build_map.
+"""
+
+from collections import defaultdict
+import math
+from typing import Dict, Hashable, List, Optional, Tuple
+
+"""((top lat, left lon), (bottom lat, right lon)), as meteostat's Stations.bounds"""
+BBox = Tuple[Tuple[float, float], Tuple[float, float]]
+
+LatLon = Tuple[float, float]
+
+EARTH_RADIUS_KM = 6371.0
+
+# map cell size, in px
+CELL_PX = 12
+
+
+def points(bbox: BBox, step: float) -> List[LatLon]:
+    """Grid points every `step` degrees, row by row from the top left."""
+    (top, left), (bottom, right) = bbox
+    n_rows = int(round((top - bottom) / step)) + 1
+    n_cols = int(round((right - left) / step)) + 1
+    return [
+        (round(top - r * step, 6), round(left + c * step, 6))
+        for r in range(n_rows)
+        for c in range(n_cols)
+    ]
+
+
+def distance_km(a: LatLon, b: LatLon) -> float:
+    """Great-circle (haversine) distance."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+class SpatialIndex:
+    """Points bucketed into `bucket`-degree cells, for nearest-neighbor lookups
+    that only look at the few buckets around the query."""
+
+    def __init__(self, bucket: float = 1.0):
+        self.bucket = bucket
+        self.buckets: Dict[Tuple[int, int], List[Tuple[Hashable, LatLon]]] = (
+            defaultdict(list)
+        )
+
+    def _cell(self, latlon: LatLon) -> Tuple[int, int]:
+        return (
+            math.floor(latlon[0] / self.bucket),
+            math.floor(latlon[1] / self.bucket),
+        )
+
+    def add(self, key: Hashable, latlon: LatLon):
+        self.buckets[self._cell(latlon)].append((key, latlon))
+
+    def nearest(
+        self, latlon: LatLon, max_km: float
+    ) -> Optional[Tuple[Hashable, LatLon]]:
+        """Closest point within max_km, or None."""
+        # degrees of latitude that max_km can span; longitude degrees shrink
+        # toward the poles, so widen by 1/cos(lat)
+        lat_reach = max_km / 111.0
+        lon_reach = lat_reach / max(0.01, math.cos(math.radians(latlon[0])))
+        r_lat = math.ceil(lat_reach / self.bucket)
+        r_lon = math.ceil(lon_reach / self.bucket)
+        row, col = self._cell(latlon)
+        best, best_km = None, max_km
+        for i in range(row - r_lat, row + r_lat + 1):
+            for j in range(col - r_lon, col + r_lon + 1):
+                for key, candidate in self.buckets.get((i, j), []):
+                    km = distance_km(latlon, candidate)
+                    if km <= best_km:
+                        best, best_km = (key, candidate), km
+        return best
+
+
+def render_map(
+    bbox: BBox,
+    step: float,
+    values: Dict[LatLon, float],
+    color: str,
+    titles: Dict[LatLon, str] = {},
+) -> str:
+    """SVG with a cell per grid point, filled with `color` at opacity = its value
+    (0 to 1). Points without a value (e.g., no station nearby) are left blank."""
+    (top, left), (bottom, right) = bbox
+    width = (int(round((right - left) / step)) + 1) * CELL_PX
+    height = (int(round((top - bottom) / step)) + 1) * CELL_PX
+    buf = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">',
+        f'<rect width="{width}" height="{height}" fill="#f4f4f4"/>',
+    ]
+    for (lat, lon), value in values.items():
+        x = int(round((lon - left) / step)) * CELL_PX
+        y = int(round((top - lat) / step)) * CELL_PX
+        title = titles.get((lat, lon), f"{lat}, {lon}: {value:.0%}")
+        buf.append(
+            f'<rect x="{x}" y="{y}" width="{CELL_PX}" height="{CELL_PX}"'
+            f' fill="{color}" fill-opacity="{round(0.1 + 0.9 * value, 2)}">'
+            f"<title>{title}</title></rect>"
+        )
+    buf.append("</svg>")
+    return "".join(buf)
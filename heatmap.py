@@ -0,0 +1,157 @@
+"""Calendar heatmap view: one compact SVG tile per (location, year).
+
+Each tile is a strip with one column per day of the year: the top cell is colored
+by temperature (same thresholds as render_data's bars), the bottom cell's opacity
+shows precipitation. Stacking a location's years gives years x days-of-year.
+
+Tiles are written to output/tiles/, named by a fingerprint of their data, and are
+only drawn when that file doesn't already exist.
+"""
+
+import calendar
+from html import escape
+import os
+from typing import Sequence, Tuple
+
+from cache import write_atomic
+from dates import month_span, year_days
+from dataset import (
+    SOURCE_MISSING,
+    SOURCE_OBSERVED,
+    DataView,
+    MetricsView,
+    day_sources,
+    fingerprint,
+    source_key,
+)
+import units
+
+TILE_DIR = "output/tiles"
+
+# bump when tiles' look changes, so old ones aren't reused
+TILE_VERSION = 2
+
+CELL_WIDTH = 3
+TEMP_HEIGHT = 12
+PRECIP_HEIGHT = 6
+
+# tachyons' dark-red, red, yellow, blue
+COLORS = {
+    "dark-red": "#e7040f",
+    "red": "#ff4136",
+    "yellow": "#ffd700",
+    "blue": "#357edd",
+    "light-gray": "#eee",
+}
+
+
+def temp_color(temp: float, system: units.System = units.IMPERIAL) -> str:
+    dark_red, red, yellow = system.colors
+    if temp > dark_red:
+        return COLORS["dark-red"]
+    if temp > red:
+        return COLORS["red"]
+    if temp > yellow:
+        return COLORS["yellow"]
+    return COLORS["blue"]
+
+
+def tile_svg(
+    year: int,
+    year_data: Sequence[Tuple[int, MetricsView]],
+    key: str,
+    system: units.System = units.IMPERIAL,
+) -> str:
+    n_days = year_days(year)
+    width, height = n_days * CELL_WIDTH, TEMP_HEIGHT + PRECIP_HEIGHT
+    buf = []
+    buf.append(
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">'
+    )
+    for month, metrics in year_data:
+        offset = month_span(year, month).offset
+        sources = day_sources(metrics, key)
+        for i, (temp, precip, source) in enumerate(
+            zip(metrics[key], metrics["precip"], sources)
+        ):
+            x = (offset + i) * CELL_WIDTH
+            if source == SOURCE_MISSING:
+                buf.append(
+                    f'<rect x="{x}" y="0" width="{CELL_WIDTH}" height="{TEMP_HEIGHT}"'
+                    f' fill="{COLORS["light-gray"]}"><title>missing</title></rect>'
+                )
+                continue
+            # filled-in days (see dataset.SOURCE_*) are drawn lighter
+            faded = "" if source == SOURCE_OBSERVED else ' fill-opacity="0.5"'
+            buf.append(
+                f'<rect x="{x}" y="0" width="{CELL_WIDTH}" height="{TEMP_HEIGHT}"'
+                f' fill="{temp_color(temp, system)}"{faded}><title>{round(temp)}</title></rect>'
+            )
+            if precip > 0:
+                # fully opaque from 0.8in
+                opacity = round(min(1.0, 0.2 + precip * system.precip_px / 10), 2)
+                buf.append(
+                    f'<rect x="{x}" y="{TEMP_HEIGHT}" width="{CELL_WIDTH}"'
+                    f' height="{PRECIP_HEIGHT}" fill="{COLORS["blue"]}"'
+                    f' fill-opacity="{opacity}"/>'
+                )
+    buf.append("</svg>")
+    return "".join(buf)
+
+
+def tile(
+    location_display: str,
+    year: int,
+    year_data: Sequence[Tuple[int, MetricsView]],
+    key: str,
+    system: units.System = units.IMPERIAL,
+    page_dir: str = "output",
+) -> str:
+    """Writes the tile if needed. Returns its path, relative to page_dir (where the
+    page linking to it is)."""
+    # only what's drawn, as plain lists (workers get arrays, see main.pack)
+    drawn = [
+        (
+            month,
+            {
+                metric: list(metrics[metric])
+                for metric in [key, "precip", source_key(key)]
+                if metric in metrics
+            },
+        )
+        for month, metrics in year_data
+    ]
+    name = fingerprint(
+        (f"{location_display}/{key}/{system.name}/{TILE_VERSION}", [(year, drawn)])
+    )
+    path = os.path.join(TILE_DIR, name + ".svg")
+    if not os.path.exists(path):
+        write_atomic(path, tile_svg(year, year_data, key, system).encode())
+    return os.path.relpath(path, page_dir)
+
+
+def render_heatmap(
+    full_data: DataView,
+    key: str = "tempmax",
+    system: units.System = units.IMPERIAL,
+    page_dir: str = "output",
+) -> str:
+    """Same role as render_data, but one tile per year instead of bars per day.
+    page_dir: the directory the page is written to, which tiles are linked from."""
+    location_display, all_data = full_data
+
+    buf = []
+    buf.append(f"<h2 class='mt5'>{escape(location_display)}</h2>")
+    buf.append("<div class='nowrap f7 gray' style='margin-left: 40px;'>")
+    for month in range(1, 13):
+        width = month_span(2001, month).n_days * CELL_WIDTH
+        buf.append(
+            f"<span class='dib' style='width: {width}px;'>{calendar.month_abbr[month]}</span>"
+        )
+    buf.append("</div>")
+    for year, year_data in all_data:
+        buf.append(
+            f"<div class='nowrap'><span class='dib f7 gray' style='width: 40px;'>{year}</span>"
+            f"<img class='v-mid' src='{tile(location_display, year, year_data, key, system, page_dir)}'></div>"
+        )
+    return "\n".join(buf)
@@ -1,187 +1,589 @@
+import argparse
+from array import array
 import calendar
 import code
-from datetime import datetime
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime
+from html import escape
+from itertools import repeat
 import json
 import os
-from typing import List, Tuple, Dict
+import sys
+import time
+from typing import Any, Callable, List, Optional, Tuple, Dict
 
 from geopy.geocoders import Nominatim
-from jinja2 import Template
+from markupsafe import Markup
 from mbforbes_python_utils import read, write
-from meteostat import Point, Daily
+from meteostat import Point, Daily, Stations
+import numpy as np
 import pandas as pd
 import requests
 
-""" (location name, [(year, [(month, [temp1, temp2, ...], [precip, precip2, ...])])]"""
-Data = Tuple[str, List[Tuple[int, List[Tuple[int, List[float], List[float]]]]]]
+import archive
+import cache
+import compare
+import daemon
+import dates
+import gazetteer
+import grid
+import pages
+import pipeline
+import server
+import sitegen
+import stats
+import units
+from dates import MonthSpan
+from dataset import (
+    SOURCE_INTERPOLATED,
+    SOURCE_MISSING,
+    SOURCE_OBSERVED,
+    SOURCE_OTHER_PROVIDER,
+    Data,
+    DataView,
+    PackedData,
+    LocationCache,
+    Metrics,
+    day_sources,
+    grid_cell,
+    normalize_location,
+    source_key,
+)
+from heatmap import render_heatmap
 
-# format {"Display Name": [lat, lon], ...}
 LOCATION_CACHE_PATH = "cache/locations.json"
-LocationCache = Dict[str, Tuple[float, float]]
 
+# decoded months, keyed (provider, location, year, month). sits in front of the on-disk
+# caches, and is shared by everything in the process (pages, the server).
+MONTH_CACHE = cache.LRU(maxsize=4096)
 
-def get_data_vc(
+# fetched data, plus any shared caches to read from; see cache.Store
+STORE = cache.Store(shared_roots=cache.shared_roots_from_env())
+
+# missing days in a row that get interpolated. longer gaps are filled from the
+# other provider's cache, where it has them, else left missing.
+MAX_INTERPOLATED_GAP = 3
+
+# metrics both providers have (in units.CANONICAL), so can fill each other's gaps
+CROSS_FILL_METRICS = ["temp", "tempmin", "tempmax", "precip"]
+
+# metrics whose gaps are filled (and which get provenance): what can be drawn (any
+# temperature, as render_data's key, and precip), which includes CROSS_FILL_METRICS.
+# the rest are passed through, gaps and all.
+FILLED_METRICS = [m for m, unit in units.CANONICAL.items() if unit == "°C"] + ["precip"]
+
+# decimals kept from archived (float32) values
+ARCHIVE_DECIMALS = 4
+
+# fetches in progress, by cache key, so concurrent misses on one month (from
+# threads here) share a single fetch. across processes, see Store.lock_path.
+FLIGHTS = cache.SingleFlight()
+
+# per-location daily arrays, in front of the on-disk caches
+ARCHIVES = archive.Archives()
+
+VC_BASE_URL = "https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline"
+VC_UNIT_GROUP = "metric"  # see units.CANONICAL
+
+# files a month could have in the old cache/vc/ layout
+VC_LEGACY_EXTS = [".json", ".json.gz", ".days.json"]
+
+# years pages cover unless told otherwise: this one and YEARS_BACK before it. the
+# daemon keeps these cached (see keep_warm), so builds of them are warm.
+YEARS_BACK = 3
+DEFAULT_YEARS = dates.recent_years(YEARS_BACK)
+DEFAULT_YEARS_ARG = ",".join(str(year) for year in DEFAULT_YEARS)
+
+# None until built; see gazetteer.py
+GAZETTEER = gazetteer.open_default()
+
+# meteostat column -> metric name (VC's, see doc/response.py)
+MS_METRICS = {
+    "tavg": "temp",
+    "tmin": "tempmin",
+    "tmax": "tempmax",
+    "prcp": "precip",
+    "snow": "snow",
+    "wdir": "winddir",
+    "wspd": "windspeed",
+    "wpgt": "windgust",
+    "pres": "pressure",
+    "tsun": "sunshine",
+}
+
+
+def location2latlon(
+    lc: LocationCache, display_name: str, offline: bool = False
+) -> Tuple[float, float]:
+    """Cache-aware, including for aliases that only differ in spacing, case, or
+    accents. Tries the offline gazetteer (if built), then Nominatim (unless offline,
+    which raises cache.CacheMiss instead)."""
+    if display_name in lc:
+        return lc[display_name]
+    name = normalize_location(display_name)
+    for known, latlon in lc.items():
+        if normalize_location(known) == name:
+            lc[display_name] = latlon
+            return latlon
+    found: Optional[Tuple[float, float]] = (
+        GAZETTEER.lookup(display_name) if GAZETTEER is not None else None
+    )
+    if found is None and offline:
+        raise cache.CacheMiss(f"location {display_name}")
+    if found is None:
+        position = Nominatim(user_agent=os.getlogin()).geocode(display_name)
+        found = (position.latitude, position.longitude)
+    lc[display_name] = found
+    return found
+
+
+def canonical_location(
+    lc: LocationCache, display_name: str, offline: bool = False
+) -> Tuple[str, str]:
+    """(grid cell, normalized name). Every cache layer keys on the cell, so all the
+    names for one place share a single fetch."""
+    lat, lon = location2latlon(lc, display_name, offline)
+    return grid_cell(lat, lon), normalize_location(display_name)
+
+
+def migrate_cache_keys(lc: LocationCache):
+    """Re-keys cache entries from before grid cells (keyed on name), where we know
+    the name's coordinates."""
+    cells = {
+        normalize_location(known): grid_cell(*latlon) for known, latlon in lc.items()
+    }
+    for key, entry in list(STORE.manifest.items()):
+        if "cell" in entry or entry["location"] not in cells:
+            continue
+        cell = cells[entry["location"]]
+        start, end = date.fromisoformat(entry["start"]), date.fromisoformat(
+            entry["end"]
+        )
+        new_key = STORE.key(entry["provider"], cell, start, end)
+        new_entry = {
+            "provider": entry["provider"],
+            "cell": cell,
+            "name": entry["location"],
+            "start": entry["start"],
+            "end": entry["end"],
+        }
+        print(f"Re-keying cached {entry['location']} {entry['start']}")
+        STORE.rekey(key, new_key, new_entry)
+
+
+def legacy_stem(provider: str, location_display: str, span: MonthSpan) -> str:
+    """Where a month was cached before the content-addressed store; see cache.adopt."""
+    location = location_display.replace(" ", "")
+    return f"cache/{provider}/" + "_".join([location, *span.legacy()])
+
+
+def load_month_vc(
+    lc: LocationCache,
     location_display: str,
-    temperature_key: str,
-    months=[2, 3],
-    years=[2020, 2021, 2022],
-) -> Data:
-    """Uses visualcrossing.
-    temperature_key: "tempmax" or "feelslikemax"
+    span: MonthSpan,
+    offline: bool = False,
+):
+    """One month from visualcrossing, from disk or the network. Returns the cached
+    projection (see cache.py): {metric: [per-day values, None if missing]}.
+
+    offline: raise cache.CacheMiss instead of fetching.
     """
-    # global settings
-    api_key = read("secrets/visualcrossing_api_key.txt")
-    # print(api_key)
-    base_url = "https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline"
-    unit_group = "us"  # vs metric
-    content_type = "json"
-    include = "days"
-
-    all_data = []
-    for year in years:
-        year_data = []
-        for month in months:
-            last_month_day = calendar.monthrange(year, month)[1]
-
-            # request settings
-            # location_display = "Tirana, Albania"  # NOTE: Try with spaces later
-            location = location_display.replace(" ", "")
-            start_date = f"{year}-{month}-01"  # inclusive
-            end_date = f"{year}-{month}-{last_month_day}"  # inclusive
-
-            cache_path = (
-                "cache/vc/" + "_".join([location, start_date, end_date]) + ".json"
+    cell, name = canonical_location(lc, location_display, offline)
+    start, end = span.start, span.end
+
+    key = STORE.key("vc", cell, start, end)
+    cache_stem = STORE.local_stem(key)
+    # any file load_vc reads
+    for stem in STORE.stems(key, [".days.json", ".json.gz", ".json"]):
+        days = cache.load_vc(stem, cache_stem, STORE.exists)
+        if days is not None:
+            print("Cached data found")
+            return days
+    if cache.adopt(
+        legacy_stem("vc", location_display, span), cache_stem, VC_LEGACY_EXTS
+    ):
+        STORE.record(key, "vc", cell, name, start, end)
+        return cache.load_vc(cache_stem)
+    if offline:
+        raise cache.CacheMiss(f"vc {location_display} {start}")
+
+    def fetch():
+        with cache.file_lock(STORE.lock_path(key)):
+            # another process may have fetched it while we waited
+            days = cache.load_vc(cache_stem)
+            if days is not None:
+                return days
+            print("Requesting data")
+            api_key = read("secrets/visualcrossing_api_key.txt")
+            # by coordinates, so the data matches the cell it's cached under
+            lat, lon = location2latlon(lc, location_display)
+            start_date, end_date = span.iso()  # inclusive
+            url = f"{VC_BASE_URL}/{lat},{lon}/{start_date}/{end_date}?unitGroup={VC_UNIT_GROUP}&contentType=json&include=days&key={api_key}"
+            response = requests.get(url)
+            assert response.status_code == 200, "Not handling bad responses rn."
+            # full response type given in doc/response.py. VC doesn't say which
+            # units it answered in, so note it for cache.project_vc
+            print("Saving to cache")
+            days = cache.save_vc(
+                cache_stem, {**response.json(), "unitGroup": VC_UNIT_GROUP}
             )
+            STORE.record(key, "vc", cell, name, start, end)
+            return days
+
+    return FLIGHTS.do(key, fetch)
+
+
+def load_month_ms(
+    lc: LocationCache,
+    location_display: str,
+    span: MonthSpan,
+    offline: bool = False,
+) -> pd.DataFrame:
+    """One month from meteostat, from disk or the network, as Daily(...) gives it.
+
+    offline: raise cache.CacheMiss instead of fetching.
+    """
+    cell, name = canonical_location(lc, location_display, offline)
+    start, end = span.start, span.end
+
+    key = STORE.key("ms", cell, start, end)
+    cache_path = STORE.find(key, ".csv")
+    if cache_path is None:
+        if cache.adopt(
+            legacy_stem("ms", location_display, span), STORE.local_stem(key), [".csv"]
+        ):
+            cache_path = STORE.local_stem(key) + ".csv"
+            STORE.record(key, "ms", cell, name, start, end)
+    if cache_path is not None:
+        print("Cached data found")
+        return pd.read_csv(cache_path)
+    if offline:
+        raise cache.CacheMiss(f"ms {location_display} {start}")
+
+    def fetch():
+        cache_path = STORE.local_stem(key) + ".csv"
+        with cache.file_lock(STORE.lock_path(key)):
+            # another process may have fetched it while we waited
             if os.path.exists(cache_path):
-                print("Cached data found")
-                data = json.loads(read(cache_path))
-            else:
-                print("Requesting data")
-                url = f"{base_url}/{location}/{start_date}/{end_date}?unitGroup={unit_group}&contentType={content_type}&include={include}&key={api_key}"
-                response = requests.get(url)
-                assert response.status_code == 200, "Not handling bad responses rn."
-                # print(response.json())
-                data = response.json()
-                print("Saving to cache")
-                with open(cache_path, "w") as f:
-                    json.dump(data, f)
-
-            # now, weather is in obj data. type given in doc/response.py
-            year_data.append(
-                (
-                    month,
-                    [day[temperature_key] for day in data["days"]],
-                    [day["precip"] for day in data["days"]],  # inches
-                )
-            )
-        all_data.append((year, year_data))
+                return pd.read_csv(cache_path)
+            print("Requesting data")
+            lat, lon = location2latlon(lc, location_display)
+            data = Daily(
+                Point(lat, lon),
+                datetime.combine(start, datetime.min.time()),
+                datetime.combine(end, datetime.min.time()),
+            ).fetch()
+            print("Saving to cache")
+            cache.write_atomic(cache_path, data.to_csv().encode())
+            STORE.record(key, "ms", cell, name, start, end)
+            return data
+
+    return FLIGHTS.do(key, fetch)
+
+
+def archived_month(
+    provider: str,
+    lc: LocationCache,
+    location_display: str,
+    span: MonthSpan,
+    offline: bool = False,
+) -> Metrics:
+    """The month's normalized metrics (gaps still NaN), as slices of its location's
+    archive (see archive.py). Months not archived yet are loaded and normalized
+    first."""
+    cell, _ = canonical_location(lc, location_display, offline)
+    location_archive = ARCHIVES.get(provider, cell)
+    metrics = location_archive.month(span)
+    if metrics is None:
+        load, normalize = PROVIDERS[provider]
+        location_archive.write_month(
+            span, normalize(load(lc, location_display, span, offline), span)
+        )
+        metrics = location_archive.month(span)
+        assert metrics is not None, f"{provider} {location_display} {span} archived"
+    return metrics
+
+
+def load_months(
+    provider: str,
+    lc: LocationCache,
+    location_display: str,
+    spans: List[MonthSpan],
+    offline: bool = False,
+) -> List[Metrics]:
+    """Each span's metrics: from MONTH_CACHE, else archived (see archived_month) and
+    gap-filled, all of the location's misses together.
+
+    offline: raise cache.CacheMiss instead of fetching.
+    """
+    cell, _ = canonical_location(lc, location_display, offline)
+    memo_keys = [(provider, cell, span.year, span.month) for span in spans]
+    found = [MONTH_CACHE.get(memo_key) for memo_key in memo_keys]
+    todo = [i for i, metrics in enumerate(found) if metrics is None]
+    filled = fill_months(
+        provider,
+        lc,
+        location_display,
+        [spans[i] for i in todo],
+        [
+            archived_month(provider, lc, location_display, spans[i], offline)
+            for i in todo
+        ],
+    )
+    for i, metrics in zip(todo, filled):
+        MONTH_CACHE.put(memo_keys[i], metrics)
+        found[i] = metrics
+    return [metrics for metrics in found if metrics is not None]
+
+
+def fill_months(
+    provider: str,
+    lc: LocationCache,
+    location_display: str,
+    spans: List[MonthSpan],
+    months: List[Metrics],
+) -> List[Metrics]:
+    """Normalized metrics of a location's months -> with gaps filled where we can."""
+    filled = fill_gaps(months)
+    for span, metrics in zip(spans, filled):
+        if any(
+            SOURCE_MISSING in metrics[source_key(m)]
+            for m in CROSS_FILL_METRICS
+            if m in metrics
+        ):
+            fill_from_other_provider(provider, lc, location_display, span, metrics)
+    return filled
+
+
+def fill_gaps(months: List[Metrics]) -> List[Metrics]:
+    """Interpolates runs of up to MAX_INTERPOLATED_GAP missing days within each
+    month, for all of FILLED_METRICS of all the months at once. Adds their
+    provenance (see dataset.SOURCE_*)."""
+    if len(months) == 0:
+        return []
+    metrics = [m for m in FILLED_METRICS if all(m in month for month in months)]
+    lengths = [len(next(iter(month.values()))) for month in months]
+    # every month's days side by side, one row per metric. a column that's never
+    # missing goes before each month and after the last, so no run spans two months
+    starts = np.cumsum([0] + lengths[:-1]) + np.arange(1, len(months) + 1)
+    is_edge = np.ones(starts[-1] + lengths[-1] + 1, dtype=bool)
+    for start, length in zip(starts, lengths):
+        is_edge[start : start + length] = False
+    values = np.zeros((len(metrics), len(is_edge)))
+    for i, metric in enumerate(metrics):
+        values[i, ~is_edge] = np.concatenate(
+            [np.asarray(month[metric], dtype=float) for month in months]
+        )
+    # archived values are float32; rounding drops the noise that adds when they're
+    # widened back
+    values = np.round(values, ARCHIVE_DECIMALS)
+    missing = np.isnan(values)
+
+    # runs of missing days, from where the mask turns on to where it turns off
+    turns = np.diff(missing.astype(np.int8), axis=1)
+    rows, run_starts = np.nonzero(turns == 1)
+    _, run_stops = np.nonzero(turns == -1)
+    run_starts, run_lengths = run_starts + 1, run_stops - run_starts
+    # short, and with a known day of the same month on both sides
+    short = (
+        (run_lengths <= MAX_INTERPOLATED_GAP)
+        & ~is_edge[run_starts - 1]
+        & ~is_edge[run_starts + run_lengths]
+    )
+    rows, run_starts, run_lengths = rows[short], run_starts[short], run_lengths[short]
+    # one entry per day to fill: how far into its run it is (1-based), and its run
+    into = (
+        np.arange(run_lengths.sum())
+        - np.repeat(np.cumsum(run_lengths) - run_lengths, run_lengths)
+        + 1
+    )
+    rows = np.repeat(rows, run_lengths)
+    before = np.repeat(run_starts - 1, run_lengths)
+    after = before + np.repeat(run_lengths + 1, run_lengths)
+    # np.interp's arithmetic (which pandas' interpolate uses), so values match it
+    slope = (values[rows, after] - values[rows, before]) / (after - before)
+    values[rows, before + into] = slope * into + values[rows, before]
+    source = np.where(
+        missing,
+        np.where(np.isnan(values), SOURCE_MISSING, SOURCE_INTERPOLATED),
+        SOURCE_OBSERVED,
+    )
+
+    result: List[Metrics] = []
+    for month, start, length in zip(months, starts, lengths):
+        filled: Metrics = {}
+        for metric, month_values in month.items():
+            if metric not in metrics:
+                filled[metric] = np.round(
+                    np.asarray(month_values, dtype=float), ARCHIVE_DECIMALS
+                ).tolist()
+        for i, metric in enumerate(metrics):
+            filled[metric] = values[i, start : start + length].tolist()
+            filled[source_key(metric)] = source[i, start : start + length].tolist()
+        result.append(filled)
+    return result
+
+
+def fill_from_other_provider(
+    provider: str,
+    lc: LocationCache,
+    location_display: str,
+    span: MonthSpan,
+    metrics: Metrics,
+):
+    """Fills what's still missing from the other provider, in place, but only if it
+    already has the month cached; never fetches."""
+    other = "vc" if provider == "ms" else "ms"
+    try:
+        other_metrics = archived_month(other, lc, location_display, span, offline=True)
+    except cache.CacheMiss:
+        return
+    for metric in CROSS_FILL_METRICS:
+        if metric not in metrics or metric not in other_metrics:
+            continue
+        values = np.array(metrics[metric], dtype=float)
+        other_values = np.array(other_metrics[metric], dtype=float)
+        if len(values) != len(other_values):
+            continue
+        source = np.array(metrics[source_key(metric)])
+        use = np.isnan(values) & ~np.isnan(other_values)
+        values[use] = other_values[use]
+        source[use] = SOURCE_OTHER_PROVIDER
+        metrics[metric] = values.tolist()
+        metrics[source_key(metric)] = source.tolist()
+
+
+def get_data(
+    provider: str,
+    lc: LocationCache,
+    location_display: str,
+    months=[2, 3],
+    years=DEFAULT_YEARS,
+    offline: bool = False,
+) -> Data:
+    spans = dates.plan(years, months)
+    metrics = iter(load_months(provider, lc, location_display, spans, offline))
+    all_data = [
+        (year, [(span.month, next(metrics)) for span in year_spans])
+        for year, year_spans in dates.by_year(spans)
+    ]
     return (location_display, all_data)
 
 
-def location2latlon(lc: LocationCache, display_name: str) -> Tuple[float, float]:
-    """Cache-aware. uses Nominatim to fetch if unknown."""
-    if display_name in lc:
-        return lc[display_name]
-    position = Nominatim(user_agent=os.getlogin()).geocode(display_name)
-    lat, lon = position.latitude, position.longitude
-    lc[display_name] = (lat, lon)
-    return (lat, lon)
+def get_data_vc(
+    lc: LocationCache,
+    location_display: str,
+    months=[2, 3],
+    years=DEFAULT_YEARS,
+) -> Data:
+    """Uses visualcrossing. Keeps every numeric daily field (cache.VC_METRICS)."""
+    return get_data("vc", lc, location_display, months, years)
 
 
 def get_data_ms(
     lc: LocationCache,
     location_display_name: str,
     months=[2, 3],
-    years=[2020, 2021, 2022],
+    years=DEFAULT_YEARS,
 ) -> Data:
-    """Uses meteostat (and geopy's nominatim).
-    key: "tempmax" or "feelslikemax"
-    """
-    lat, lon = location2latlon(lc, location_display_name)
-
-    # check cache
-    location_cache_name = location_display_name.replace(" ", "")
-
-    all_data = []
-    for year in years:
-        year_data = []
-        for month in months:
-            last_month_day = calendar.monthrange(year, month)[1]
-            start_date = f"{year}-{month}-01"  # inclusive
-            end_date = f"{year}-{month}-{last_month_day}"  # inclusive
-
-            cache_path = (
-                "cache/ms/"
-                + "_".join([location_cache_name, start_date, end_date])
-                + ".csv"
-            )
-            if os.path.exists(cache_path):
-                print("Cached data found")
-                data = pd.read_csv(cache_path)
-            else:
-                print("Requesting data")
-                data = Daily(
-                    Point(lat, lon),
-                    datetime(year, month, 1),
-                    datetime(year, month, last_month_day),
-                ).fetch()
-                print("Saving to cache")
-                data.to_csv(cache_path)
-
-            # print(year, month)
-            # code.interact(local=dict(globals(), **locals()))
-
-            year_data.append(
-                (
-                    month,
-                    (data.tmax.fillna(0) * 1.8 + 32).tolist(),
-                    # NOTE: Not sure about unit, maybe ml? so -> inches?
-                    (data.prcp.fillna(0) * 0.0610237).tolist(),
-                )
-            )
+    """Uses meteostat (and geopy's nominatim). Keeps every column (MS_METRICS)."""
+    return get_data("ms", lc, location_display_name, months, years)
 
-        all_data.append((year, year_data))
-    return (location_display_name, all_data)
 
+def ms_metrics(data: pd.DataFrame, span: MonthSpan) -> Metrics:
+    """Renames meteostat's columns to our metric names, in units.CANONICAL. Rows
+    are lined up with the month's days; days meteostat has no row for are NaN."""
+    days = pd.date_range(span.start, periods=span.n_days)
+    data = data.set_index(pd.to_datetime(data["time"])) if "time" in data else data
+    data = data.reindex(days)
+    metrics = {}
+    for column, metric in MS_METRICS.items():
+        if column not in data:
+            continue
+        values = data[column]
+        if metric == "snow":
+            # meteostat's is in mm
+            values = values / 10
+        metrics[metric] = values.tolist()
+    return metrics
+
+
+def vc_metrics(days: Dict[str, List[Optional[float]]], span: MonthSpan) -> Metrics:
+    """The cached projection, with missing days (None) as NaN."""
+    return {
+        metric: np.array(values, dtype=float).tolist()
+        for metric, values in days.items()
+    }
 
-def render_data(full_data: Data) -> str:
-    location_display, all_data = full_data
 
-    # render
-    key = "tempmax"  # alt: "feelslikemax"
-    # key = "feelslikemax"  # alt: "tempmax"
+# provider -> (load a month from disk or network, normalize it to Metrics)
+PROVIDERS = {
+    "vc": (load_month_vc, vc_metrics),
+    "ms": (load_month_ms, ms_metrics),
+}
+
+
+def render_data(
+    full_data: DataView, key: str = "tempmax", system: units.System = units.IMPERIAL
+) -> str:
+    """key: which temperature metric to draw, e.g., "tempmax" or "feelslikemax".
+    full_data is in system's units (see units.convert)."""
+    location_display, all_data = full_data
+    summary = stats.summarize(full_data, key, system)
+    month_summaries = iter(summary["months"])
+    temp_scale, temp_offset = system.temp_px
 
     buf = []
-    buf.append(f"<h2 class='mt5'>{location_display}</h2>")
+    buf.append(f"<h2 class='mt5 mb1'>{escape(location_display)}</h2>")
+    buf.append(
+        f"<div class='f6 gray mb3'>{stats.render_summary(summary['location'], system)}</div>"
+    )
     prev_year = None
     for year, year_data in all_data:
         buf.append("<div>")
-        for month, temps, precips in year_data:
+        for month, metrics in year_data:
+            temps, precips = metrics[key], metrics["precip"]
+            sources = day_sources(metrics, key)
+            precip_sources = day_sources(metrics, "precip")
             buf.append("<div class='dib mr3'>")
-            for temp in temps:
-                color = (
-                    "dark-red"
-                    if temp > 100
-                    else ("red" if temp > 90 else ("yellow" if temp > 70 else "blue"))
-                )
+            labels: List[str] = []
+            for temp, source in zip(temps, sources):
+                if source == SOURCE_MISSING:
+                    # short gray stub, so the other days stay in place
+                    buf.append(
+                        '<div style="width: 10px; height: 4px" class="bg-light-gray dib mb0" title="missing"></div>'
+                    )
+                    labels.append("")
+                    continue
+                color = pages.temp_color(temp, system)
+                filled = pages.FILLED_CLASSES.get(source, "")
+                height = round(temp * temp_scale + temp_offset, 2)
                 buf.append(
-                    f'<div style="width: 10px; height: {temp}px" class="bg-{color} dib mb0"></div>'
+                    f'<div style="width: 10px; height: {height}px" class="bg-{color} dib mb0{filled}"></div>'
                 )
+                labels.append(str(round(temp)))
             buf.append("<br class='mv0'>")
-            for temp in temps:
+            for label in labels:
                 buf.append(
-                    f"<span class='b dib' style='width: 10px; font-size: 7px;'>{round(temp)}</span>"
+                    f"<span class='b dib' style='width: 10px; font-size: 7px;'>{label}</span>"
                 )
             buf.append('<br><div style="height: 50px;">')
-            for precip in precips:
+            for precip, source in zip(precips, precip_sources):
+                if source == SOURCE_MISSING:
+                    precip = 0
                 buf.append(
-                    f'<div style="width: 10px; height: {precip * 10}px" class="bg-blue dib mb0 v-top o-80"></div>'
+                    f'<div style="width: 10px; height: {round(precip * system.precip_px, 2)}px" class="bg-blue dib mb0 v-top o-80"></div>'
                 )
             buf.append("</div>")
 
             # year, month, _ = start_date.split("-")
             buf.append(
-                f"<h3 class='mt1 mb3 tc gray'>{calendar.month_name[month]}, {year}</h3>"
+                f"<h3 class='mt1 mb1 tc gray'>{calendar.month_name[month]}, {year}</h3>"
+            )
+            buf.append(
+                f"<div class='f7 gray tc mb3' style='width: {len(temps) * 10}px;'>"
+                f"{stats.render_summary(next(month_summaries), system)}</div>"
             )
             buf.append("</div>")
         buf.append("<div>")
@@ -189,58 +591,540 @@ def render_data(full_data: Data) -> str:
     return "\n".join(buf)
 
 
-def build_page_vc():
-    buf = []
+def pack(full_data: Data, key: str = "tempmax") -> PackedData:
+    """Only the metrics render_data(key) needs, as float arrays (and their
+    provenance, as byte arrays).
+
+    Much smaller to pickle across processes than the full lists of every metric.
+    """
+    location_display, all_data = full_data
+    return (
+        location_display,
+        [
+            (
+                year,
+                [
+                    (
+                        month,
+                        {
+                            metric: array(
+                                "b" if metric.endswith("_source") else "d",
+                                metrics[metric],
+                            )
+                            for metric in [
+                                key,
+                                "precip",
+                                source_key(key),
+                                source_key("precip"),
+                            ]
+                            if metric in metrics
+                        },
+                    )
+                    for month, metrics in year_data
+                ],
+            )
+            for year, year_data in all_data
+        ],
+    )
 
-    buf.append(render_data(get_data_vc("Belgrade, Serbia", "tempmax")))
-    buf.append(render_data(get_data_vc("Bucharest, Romania", "tempmax")))
-    buf.append(render_data(get_data_vc("Sarajevo, Bosnia", "tempmax")))
-    buf.append(render_data(get_data_vc("Tirana, Albania", "tempmax")))
-    # buf.append(get_place_html("Tbilisi, Georgia"))
 
-    templ_main = Template(read("templates/main.html"))
-    write("output/tester-vc.html", templ_main.render(content="\n".join(buf)))
+# view name -> renderer for one location
+VIEWS = {"bars": render_data, "heatmap": render_heatmap}
 
 
-def build_page_ms(lc: LocationCache):
-    buf = []
+def view_renderer(view: str, page_dir: str = "output") -> Callable[..., str]:
+    """VIEWS[view], linking any files it writes (heatmap tiles) from page_dir."""
+    if view == "heatmap":
+        return partial(render_heatmap, page_dir=page_dir)
+    return VIEWS[view]
+
+
+def render_all(
+    datas: List[Data],
+    key: str = "tempmax",
+    workers: Optional[int] = 1,
+    view: str = "bars",
+    system: units.System = units.IMPERIAL,
+    page_dir: str = "output",
+) -> List[str]:
+    """Renders each location (see VIEWS), in order, across `workers` processes.
+    datas are already in system's units; the page goes in page_dir.
+
+    workers=None uses every core. Only worth it for big pages; starting the pool
+    costs more than rendering a handful of locations.
+    """
+    render = view_renderer(view, page_dir)
+    if workers == 1 or len(datas) < 2:
+        return [render(full_data, key, system) for full_data in datas]
+    n_workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(datas) // (n_workers * 4))
+    packed = [pack(full_data, key) for full_data in datas]
+    with ProcessPoolExecutor(n_workers) as pool:
+        return list(
+            pool.map(render, packed, repeat(key), repeat(system), chunksize=chunksize)
+        )
+
+
+def render_page(
+    datas: List[Data],
+    key: str = "tempmax",
+    workers: Optional[int] = 1,
+    view: str = "bars",
+    system: units.System = units.IMPERIAL,
+    page_dir: str = "output",
+    rank_months: Optional[List[int]] = None,
+    hot: Optional[float] = None,
+    wet: Optional[float] = None,
+) -> str:
+    """Full page: ranking summary up top, then each location's bars (or heatmap).
+    datas are as cached (see units.CANONICAL), and are shown in system's units.
+    page_dir: where the page will be written.
+
+    The ranking (see compare.py) is over rank_months (default: all), with hot and
+    wet in system's units (default: its own)."""
+    datas = [units.convert(full_data, system) for full_data in datas]
+    hot = system.hot if hot is None else hot
+    wet = system.wet if wet is None else wet
+    summary = compare.render_ranking(
+        compare.rank(compare.build_index(datas, key, hot, wet), rank_months),
+        months=rank_months,
+        hot=hot,
+        wet=wet,
+        temp_unit=system.temp_unit,
+        precip_unit=system.precip_unit,
+    )
+    content = "\n".join(render_all(datas, key, workers, view, system, page_dir))
+    return pages.render("main.html", summary=Markup(summary), content=Markup(content))
+
+
+# (location, months) for each page. uncomment to include.
+VC_LOCATIONS = [
+    ("Belgrade, Serbia", [2, 3]),
+    ("Bucharest, Romania", [2, 3]),
+    ("Sarajevo, Bosnia", [2, 3]),
+    ("Tirana, Albania", [2, 3]),
+    # ("Tbilisi, Georgia", [2, 3]),
+]
+
+MS_LOCATIONS = [
+    # ("Zagreb, Croatia", [2, 3]),
+    # ("Belgrade, Serbia", [2, 3]),
+    # ("Bucharest, Romania", [2, 3]),
+    # ("Sarajevo, Bosnia", [2, 3]),
+    # ("Tirana, Albania", [2, 3]),
+    # ("Tbilisi, Georgia", [2, 3]),
+    # ("Skopje, North Macedonia", [2, 3]),
+    # ("Tel Aviv, Israel", [2, 3]),
+    # ("Edinburgh, Scotland", [2, 3]),
+    # ("Kathmandu, Nepal", [2, 3]),
+    # ("Seoul, South Korea", [8, 9, 10, 11]),
+    # ("Sapporo, Japan", [8, 9, 10, 11]),
+    # ("Tokyo, Japan", [8, 9, 10, 11]),
+    # ("Miyazaki, Japan", [8, 9, 10, 11]),
+    # ("Istanbul, Turkey", [2, 3]),
+    # ("Tashkent, Uzbekistan", [2, 3]),
+    # ("Montpellier, France", [7, 8, 9]),
+    # ("Ulaanbaatar, Mongolia", [2, 3]),
+    # ("Dalanzadgad, Mongolia", [2, 3]),
+    # ("Hanoi, Vietnam", [11, 1]),
+    # ("Haiphong, Vietnam", [11, 1]),
+    # ("Sa Pa, Vietnam", [11, 1]),
+    # ("Da Nang, Vietnam", [11, 1]),
+    # ("Hoi An, Vietnam", [11, 1]),
+    # ("Ho Chi Minh City, Vietnam", [11, 1]),
+    # ("Taipei, Taiwan", [2, 3]),
+    # ("Okinawa, Japan", [4, 5, 6]),
+    ("Fukuoka, Japan", [4, 5]),
+    ("Osaka, Japan", [4, 5, 6]),
+    ("Tokyo, Japan", [4, 5, 6]),
+]
+
+# region -> its (location, months), one page each (see build_site)
+REGIONS = {
+    "balkans": [
+        ("Zagreb, Croatia", [2, 3]),
+        ("Belgrade, Serbia", [2, 3]),
+        ("Bucharest, Romania", [2, 3]),
+        ("Sarajevo, Bosnia", [2, 3]),
+        ("Tirana, Albania", [2, 3]),
+        ("Skopje, North Macedonia", [2, 3]),
+        ("Istanbul, Turkey", [2, 3]),
+    ],
+    "central-asia": [
+        ("Tbilisi, Georgia", [2, 3]),
+        ("Tashkent, Uzbekistan", [2, 3]),
+        ("Ulaanbaatar, Mongolia", [2, 3]),
+        ("Dalanzadgad, Mongolia", [2, 3]),
+        ("Kathmandu, Nepal", [2, 3]),
+    ],
+    "east-asia-autumn": [
+        ("Seoul, South Korea", [8, 9, 10, 11]),
+        ("Sapporo, Japan", [8, 9, 10, 11]),
+        ("Tokyo, Japan", [8, 9, 10, 11]),
+        ("Miyazaki, Japan", [8, 9, 10, 11]),
+    ],
+    "japan-spring": [
+        ("Taipei, Taiwan", [2, 3]),
+        ("Okinawa, Japan", [4, 5, 6]),
+        ("Fukuoka, Japan", [4, 5]),
+        ("Osaka, Japan", [4, 5, 6]),
+        ("Tokyo, Japan", [4, 5, 6]),
+    ],
+    "vietnam": [
+        ("Hanoi, Vietnam", [11, 1]),
+        ("Haiphong, Vietnam", [11, 1]),
+        ("Sa Pa, Vietnam", [11, 1]),
+        ("Da Nang, Vietnam", [11, 1]),
+        ("Hoi An, Vietnam", [11, 1]),
+        ("Ho Chi Minh City, Vietnam", [11, 1]),
+    ],
+    "elsewhere": [
+        ("Tel Aviv, Israel", [2, 3]),
+        ("Edinburgh, Scotland", [2, 3]),
+        ("Montpellier, France", [7, 8, 9]),
+    ],
+}
+
+
+def stream_page(
+    provider: str,
+    lc: LocationCache,
+    locations: List[Tuple[str, List[int]]],
+    path: str,
+    key: str = "tempmax",
+    years=DEFAULT_YEARS,
+    offline: bool = False,
+    system: units.System = units.IMPERIAL,
+    view: str = "bars",
+):
+    """Builds a page as a pipeline: geocode -> fetch -> fill gaps -> render -> write.
+    Each location is rendered as `view` (see VIEWS).
+
+    Each stage runs on its own thread (see pipeline.py), so the first location is
+    rendered and written while later ones are still fetching, and memory is bounded
+    by the queues, not the page. No ranking table, as that needs every location.
+    """
+
+    def geocode(item):
+        location_display, months = item
+        cell, _ = canonical_location(lc, location_display, offline)
+        yield (location_display, cell, months)
+
+    # month items are (location, span, memo key, metrics, is_filled), and
+    # (location, None, ...) ends a location
+    def fetch(item):
+        location_display, cell, months = item
+        for span in dates.plan(years, months):
+            memo_key = (provider, cell, span.year, span.month)
+            metrics = MONTH_CACHE.get(memo_key)
+            if metrics is not None:
+                yield (location_display, span, memo_key, metrics, True)
+            else:
+                metrics = archived_month(provider, lc, location_display, span, offline)
+                yield (location_display, span, memo_key, metrics, False)
+        yield (location_display, None, None, None, True)
+
+    # a location's months, until its end item; then they're gap-filled together
+    location_months: List[Tuple[MonthSpan, Any, Metrics, bool]] = []
+
+    def fill(item):
+        location_display, span, memo_key, metrics, is_filled = item
+        if span is not None:
+            location_months.append((span, memo_key, metrics, is_filled))
+            return
+        todo = [month for month in location_months if not month[3]]
+        filled = iter(
+            fill_months(
+                provider,
+                lc,
+                location_display,
+                [span for span, _, _, _ in todo],
+                [metrics for _, _, metrics, _ in todo],
+            )
+        )
+        for span, memo_key, metrics, is_filled in location_months:
+            if not is_filled:
+                metrics = next(filled)
+                MONTH_CACHE.put(memo_key, metrics)
+            yield (location_display, span, metrics)
+        location_months.clear()
+        yield (location_display, None, None)
+
+    months_so_far: List[Tuple[MonthSpan, Metrics]] = []
+    render_location = view_renderer(view, os.path.dirname(path) or ".")
+
+    def render(item):
+        location_display, span, metrics = item
+        if span is not None:
+            months_so_far.append((span, metrics))
+            return
+        all_data: List[Tuple[int, List[Tuple[int, Metrics]]]] = []
+        for span, metrics in months_so_far:
+            if len(all_data) == 0 or all_data[-1][0] != span.year:
+                all_data.append((span.year, []))
+            all_data[-1][1].append((span.month, metrics))
+        months_so_far.clear()
+        full_data = units.convert((location_display, all_data), system)
+        yield render_location(full_data, key, system)
+
+    sentinel = "<!-- content -->"
+    head, tail = pages.render("main.html", content=Markup(sentinel)).split(sentinel)
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            f.write(head)
+            for fragment in pipeline.run(locations, [geocode, fetch, fill, render]):
+                f.write(fragment + "\n")
+            f.write(tail)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    print(f"Streamed {len(locations)} locations to {path}")
+
+
+def warm_load(
+    provider: str,
+    lc: LocationCache,
+    locations: List[Tuple[str, List[int]]],
+    years=DEFAULT_YEARS,
+    offline: bool = False,
+    workers: int = 8,
+):
+    """Loads every month of locations into MONTH_CACHE, parsing the cached files
+    concurrently, after listing the cache once (see Store.scan) instead of
+    checking for each file.
+
+    Geocodes one at a time first (Nominatim's policy). Anything not cached is
+    fetched and archived one month per task, then each location's months are
+    gap-filled together (see load_months).
+    """
+    started = time.perf_counter()
+    n_files = STORE.scan()
+    for name, _ in locations:
+        canonical_location(lc, name, offline)
+    todo = [
+        (name, span) for name, months in locations for span in dates.plan(years, months)
+    ]
+    with ThreadPoolExecutor(workers) as pool:
+        list(
+            pool.map(
+                lambda item: archived_month(provider, lc, item[0], item[1], offline),
+                todo,
+            )
+        )
+        list(
+            pool.map(
+                lambda location: get_data(
+                    provider, lc, location[0], location[1], years, offline
+                ),
+                locations,
+            )
+        )
+    print(
+        f"Warm load: {len(todo)} {provider} months ({n_files} cached files)"
+        f" in {time.perf_counter() - started:.2f}s"
+    )
+
+
+def build_page(
+    provider: str,
+    lc: LocationCache,
+    locations: List[Tuple[str, List[int]]],
+    path: str,
+    view: str = "bars",
+    stream: bool = False,
+    offline: bool = False,
+    years=DEFAULT_YEARS,
+    system: units.System = units.IMPERIAL,
+    workers: Optional[int] = 1,
+    rank_months: Optional[List[int]] = None,
+    hot: Optional[float] = None,
+    wet: Optional[float] = None,
+):
+    """offline: only use what's cached; raises cache.CacheMiss on the first miss.
+    workers: processes rendering locations (see render_all); not used by stream,
+    which renders on its own thread. rank_months, hot, wet: see render_page (stream
+    has no ranking)."""
+    if stream:
+        stream_page(
+            provider,
+            lc,
+            locations,
+            path,
+            years=years,
+            offline=offline,
+            system=system,
+            view=view,
+        )
+        return
+    warm_load(provider, lc, locations, years, offline)
+    datas = [
+        get_data(provider, lc, name, months, years, offline)
+        for name, months in locations
+    ]
+    write(
+        path,
+        render_page(
+            datas,
+            workers=workers,
+            view=view,
+            system=system,
+            page_dir=os.path.dirname(path) or ".",
+            rank_months=rank_months,
+            hot=hot,
+            wet=wet,
+        ),
+    )
+    print("Month cache:", MONTH_CACHE.stats())
+
+
+def build_page_vc(lc: LocationCache, view: str = "bars", workers: Optional[int] = 1):
+    build_page("vc", lc, VC_LOCATIONS, "output/tester-vc.html", view, workers=workers)
+
+
+def build_page_ms(
+    lc: LocationCache,
+    view: str = "bars",
+    stream: bool = False,
+    workers: Optional[int] = 1,
+):
+    build_page(
+        "ms", lc, MS_LOCATIONS, "output/tester-ms.html", view, stream, workers=workers
+    )
+
+
+def build_site(
+    lc: LocationCache,
+    regions=REGIONS,
+    workers: Optional[int] = None,
+    offline: bool = False,
+    years=DEFAULT_YEARS,
+):
+    """One meteostat page per region, plus an index, in output/site/. Imperial, as
+    static/chart.js's colors are."""
+    warm_load(
+        "ms",
+        lc,
+        [location for locations in regions.values() for location in locations],
+        years,
+        offline=offline,
+    )
+    packed = {
+        region: [
+            pack(
+                units.convert(
+                    get_data("ms", lc, name, months, years, offline), units.IMPERIAL
+                )
+            )
+            for name, months in locations
+        ]
+        for region, locations in regions.items()
+    }
+    sitegen.build_site(packed, workers=workers)
+    print("Month cache:", MONTH_CACHE.stats())
 
-    # buf.append(render_data(get_data_ms(lc, "Zagreb, Croatia")))
-    # buf.append(render_data(get_data_ms(lc, "Belgrade, Serbia")))
-    # buf.append(render_data(get_data_ms(lc, "Bucharest, Romania")))
-    # buf.append(render_data(get_data_ms(lc, "Sarajevo, Bosnia")))
-    # buf.append(render_data(get_data_ms(lc, "Tirana, Albania")))
-    # buf.append(render_data(get_data_ms(lc, "Tbilisi, Georgia")))
-    # buf.append(render_data(get_data_ms(lc, "Skopje, North Macedonia")))
-    # buf.append(render_data(get_data_ms(lc, "Tel Aviv, Israel")))
-    # buf.append(render_data(get_data_ms(lc, "Edinburgh, Scotland")))
-    # buf.append(render_data(get_data_ms(lc, "Kathmandu, Nepal")))
-    # buf.append(render_data(get_data_ms(lc, "Seoul, South Korea", [8, 9, 10, 11])))
-    # buf.append(render_data(get_data_ms(lc, "Sapporo, Japan", [8, 9, 10, 11])))
-    # buf.append(render_data(get_data_ms(lc, "Tokyo, Japan", [8, 9, 10, 11])))
-    # buf.append(render_data(get_data_ms(lc, "Miyazaki, Japan", [8, 9, 10, 11])))
-    # buf.append(render_data(get_data_ms(lc, "Istanbul, Turkey")))
-    # buf.append(render_data(get_data_ms(lc, "Tashkent, Uzbekistan")))
-    # buf.append(render_data(get_data_ms(lc, "Montpellier, France", [7, 8, 9])))
-    # buf.append(render_data(get_data_ms(lc, "Ulaanbaatar, Mongolia")))
-    # buf.append(render_data(get_data_ms(lc, "Dalanzadgad, Mongolia")))
-
-    # buf.append(render_data(get_data_ms(lc, "Hanoi, Vietnam", [11, 1])))
-    # buf.append(render_data(get_data_ms(lc, "Haiphong, Vietnam", [11, 1])))
-    # buf.append(render_data(get_data_ms(lc, "Sa Pa, Vietnam", [11, 1])))
-    # buf.append(render_data(get_data_ms(lc, "Da Nang, Vietnam", [11, 1])))
-    # buf.append(render_data(get_data_ms(lc, "Hoi An, Vietnam", [11, 1])))
-    # buf.append(render_data(get_data_ms(lc, "Ho Chi Minh City, Vietnam", [11, 1])))
-
-    # buf.append(render_data(get_data_ms(lc, "Taipei, Taiwan")))
-
-    # buf.append(render_data(get_data_ms(lc, "Okinawa, Japan", [4, 5, 6])))
-    buf.append(render_data(get_data_ms(lc, "Fukuoka, Japan", [4, 5])))
-    buf.append(render_data(get_data_ms(lc, "Osaka, Japan", [4, 5, 6])))
-    buf.append(render_data(get_data_ms(lc, "Tokyo, Japan", [4, 5, 6])))
-
-    templ_main = Template(read("templates/main.html"))
-    write("output/tester-ms.html", templ_main.render(content="\n".join(buf)))
+
+# rough cost of one cache miss, for `plan`: (seconds, visualcrossing records billed
+# per day fetched)
+FETCH_COST = {"vc": (1.0, 1), "ms": (0.5, 0)}
+
+# Nominatim allows one request per second
+GEOCODE_SECONDS = 1.0
+
+# per provider, files that mean a month is cached (new layout, then legacy)
+CACHED_EXTS = {
+    "vc": ([".days.json", ".json.gz"], VC_LEGACY_EXTS),
+    "ms": ([".csv"], [".csv"]),
+}
+
+
+def is_cached(
+    provider: str, lc: LocationCache, location_display: str, span: MonthSpan
+) -> bool:
+    """Whether the month can be loaded offline. Reads and changes nothing."""
+    try:
+        cell, _ = canonical_location(lc, location_display, offline=True)
+    except cache.CacheMiss:
+        return False
+    key = STORE.key(provider, cell, span.start, span.end)
+    exts, legacy_exts = CACHED_EXTS[provider]
+    stem = legacy_stem(provider, location_display, span)
+    return any(STORE.find(key, ext) is not None for ext in exts) or any(
+        os.path.exists(stem + ext) for ext in legacy_exts
+    )
+
+
+def plan_fetches(
+    provider: str,
+    lc: LocationCache,
+    locations: List[Tuple[str, List[int]]],
+    years=DEFAULT_YEARS,
+) -> List[Tuple[str, MonthSpan]]:
+    """The (location, month)s a build would have to fetch, with their cost."""
+    # only need to know, not to remember, so geocode into a copy
+    lc = dict(lc)
+    misses = []
+    geocodes = 0
+    for name, months in locations:
+        try:
+            location2latlon(lc, name, offline=True)
+        except cache.CacheMiss:
+            geocodes += 1
+        for span in dates.plan(years, months):
+            if not is_cached(provider, lc, name, span):
+                misses.append((name, span))
+    seconds_per, records_per_day = FETCH_COST[provider]
+    for name, span in misses:
+        print(f"miss  {provider}  {name}  {span.start:%Y-%m}")
+    n_months = sum(len(months) * len(years) for _, months in locations)
+    print(
+        f"{len(misses)} of {n_months} months to fetch, {geocodes} locations to"
+        f" geocode: ~{len(misses) * seconds_per + geocodes * GEOCODE_SECONDS:.0f}s"
+    )
+    if records_per_day > 0:
+        records = sum(span.n_days for _, span in misses) * records_per_day
+        print(f"{records} visualcrossing records")
+    return misses
+
+
+def prefetch(
+    provider: str,
+    lc: LocationCache,
+    locations: List[Tuple[str, List[int]]],
+    years=DEFAULT_YEARS,
+    workers: int = 8,
+):
+    """Fills the on-disk cache for locations, without rendering anything.
+
+    Geocodes one at a time (Nominatim's policy), then fetches months concurrently.
+    """
+    load, _ = PROVIDERS[provider]
+    for name, _ in locations:
+        canonical_location(lc, name)
+    todo = [
+        (name, span)
+        for name, months in locations
+        for span in dates.plan(years, months)
+        if not is_cached(provider, lc, name, span)
+    ]
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(lambda item: load(lc, *item), todo))
+    print(f"Prefetched {len(todo)} {provider} months")
+
+
+def serve(lc: LocationCache, port: int = 8000):
+    """Renders meteostat locations on demand; see server.py."""
+
+    def fetch(location: str, months: List[int]) -> Data:
+        full_data = get_data_ms(lc, location, months)
+        write(LOCATION_CACHE_PATH, json.dumps(lc), False)
+        return units.convert(full_data, units.IMPERIAL)
+
+    def page(content: str) -> str:
+        return pages.render("main.html", content=Markup(content))
+
+    server.serve(fetch, render_data, page, port)
 
 
 def ensure_file(path: str, default_contents: str):
@@ -249,13 +1133,339 @@ def ensure_file(path: str, default_contents: str):
         write(path, default_contents, False)
 
 
+# bounding boxes (grid.BBox) for build_map
+GRID_REGIONS = {
+    "japan": ((45.5, 129.5), (31.0, 146.0)),
+    "balkans": ((46.5, 13.5), (39.5, 29.5)),
+    "vietnam": ((23.5, 102.0), (8.5, 110.0)),
+}
+
+# a grid point uses the nearest station this close, else it's left off the map
+MAX_STATION_KM = 50
+
+
+def snap_to_stations(
+    bbox: grid.BBox, step: float
+) -> Tuple[Dict[grid.LatLon, str], LocationCache]:
+    """(grid point -> location name of its nearest meteostat station, those names'
+    station coordinates). The coordinates go in a LocationCache for fetching, so
+    the names are never geocoded, but aren't places to save in the real one."""
+    (top, left), (bottom, right) = bbox
+    margin = MAX_STATION_KM / 111
+    stations = (
+        Stations()
+        .bounds((top + margin, left - margin), (bottom - margin, right + margin))
+        .fetch()
+    )
+    index = grid.SpatialIndex()
+    for station_id, row in stations.iterrows():
+        index.add(station_id, (row["latitude"], row["longitude"]))
+    snapped = {}
+    coordinates: LocationCache = {}
+    for point in grid.points(bbox, step):
+        found = index.nearest(point, MAX_STATION_KM)
+        if found is None:
+            continue
+        station_id, latlon = found
+        name = f"{stations.loc[station_id, 'name']} (station {station_id})"
+        coordinates[name] = latlon
+        snapped[point] = name
+    return snapped, coordinates
+
+
+def build_map(
+    lc: LocationCache,
+    region: str,
+    step: float = 0.5,
+    months: List[int] = [4],
+    years=DEFAULT_YEARS,
+    workers: int = 8,
+    system: units.System = units.IMPERIAL,
+):
+    """Maps of hot and rainy days (see compare.summarize) over a region's grid, to
+    output/map-<region>.html."""
+    bbox = GRID_REGIONS[region]
+    snapped, coordinates = snap_to_stations(bbox, step)
+    # lc, plus the stations (not saved; see snap_to_stations)
+    lc = {**lc, **coordinates}
+    stations = sorted(set(snapped.values()))
+    print(
+        f"{len(snapped)} of {len(grid.points(bbox, step))} grid points"
+        f" use {len(stations)} stations"
+    )
+    prefetch("ms", lc, [(name, months) for name in stations], years, workers)
+
+    totals = {}
+    for name in stations:
+        total = compare.empty_summary()
+        full_data = units.convert(get_data("ms", lc, name, months, years), system)
+        by_month = compare.summarize(full_data, hot=system.hot, wet=system.wet)
+        for summary in by_month.values():
+            for field, n in summary.items():
+                total[field] += n
+        if total["days"] > 0:
+            totals[name] = total
+    maps = []
+    for field, color, label in [
+        ("hot", "#e7040f", f"Hot days (> {system.hot}{system.temp_unit})"),
+        ("wet", "#357edd", f"Rainy days (≥ {system.wet}{system.precip_unit})"),
+    ]:
+        values, titles = {}, {}
+        for point, name in snapped.items():
+            if name in totals:
+                values[point] = totals[name][field] / totals[name]["days"]
+                titles[point] = escape(f"{name}: {values[point]:.0%}")
+        maps.append(f"<h3 class='gray'>{label}</h3>")
+        maps.append(grid.render_map(bbox, step, values, color, titles))
+    month_names = ", ".join(calendar.month_abbr[m] for m in months)
+    path = f"output/map-{region}.html"
+    write(
+        path,
+        pages.render(
+            "main.html",
+            summary=Markup(f"<h2>{escape(region)}, {month_names}</h2>"),
+            content=Markup("\n".join(maps)),
+        ),
+    )
+    print("Month cache:", MONTH_CACHE.stats())
+
+
+# seconds between fetches, per provider, when keeping caches warm
+DAEMON_MIN_INTERVALS = {"vc": 2.0, "ms": 1.0}
+
+
+def watched(providers: List[str]) -> List[Tuple[str, str, List[int]]]:
+    """(provider, location, months) for every configured page and region."""
+    configs = {"vc": [VC_LOCATIONS], "ms": [MS_LOCATIONS, *REGIONS.values()]}
+    seen = set()
+    result = []
+    for provider in providers:
+        for locations in configs[provider]:
+            for name, months in locations:
+                if (provider, name, tuple(months)) not in seen:
+                    seen.add((provider, name, tuple(months)))
+                    result.append((provider, name, months))
+    return result
+
+
+def due_fetches(
+    lc: LocationCache, providers: List[str], today: Optional[date] = None
+) -> List[daemon.Job]:
+    """Finished months of watched locations that aren't cached yet."""
+    years = dates.recent_years(YEARS_BACK, today)
+    return [
+        (provider, name, span)
+        for provider, name, months in watched(providers)
+        for span in dates.plan(years, months, today)
+        if not is_cached(provider, lc, name, span)
+    ]
+
+
+def keep_warm(lc: LocationCache, providers: List[str], cycles: Optional[int] = None):
+    """Blocks, fetching new months and pre-rendering pages on a schedule; see
+    daemon.py."""
+
+    def fetch(job: daemon.Job):
+        provider, name, span = job
+        load, _ = PROVIDERS[provider]
+        load(lc, name, span)
+        write(LOCATION_CACHE_PATH, json.dumps(lc), False)
+
+    def prerender() -> Dict[str, Any]:
+        # offline, so a month that failed to fetch skips a page rather than
+        # blocking; it's retried next cycle. the same years as due_fetches (and
+        # interactive builds), and like it only finished months (see dates.plan)
+        years = dates.recent_years(YEARS_BACK)
+        builds: List[Callable[[], None]] = []
+        if "ms" in providers:
+            builds.append(partial(build_site, lc, offline=True, years=years))
+        for provider in providers:
+            locations = VC_LOCATIONS if provider == "vc" else MS_LOCATIONS
+            path = f"output/tester-{provider}.html"
+            builds.append(
+                partial(
+                    build_page, provider, lc, locations, path, offline=True, years=years
+                )
+            )
+        skipped = 0
+        for build in builds:
+            try:
+                build()
+            except cache.CacheMiss as e:
+                print(f"Not pre-rendering, not cached: {e}")
+                skipped += 1
+        return {"pages_skipped": skipped, "month_cache": MONTH_CACHE.stats()}
+
+    daemon.run(
+        lambda: due_fetches(lc, providers),
+        fetch,
+        prerender,
+        DAEMON_MIN_INTERVALS,
+        cycles=cycles,
+    )
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="main.py")
+    commands = parser.add_subparsers(dest="command")
+
+    # which locations: the provider's page config (VC_LOCATIONS or MS_LOCATIONS),
+    # a region, or --loc
+    targets = argparse.ArgumentParser(add_help=False)
+    targets.add_argument("--provider", choices=sorted(PROVIDERS), default="ms")
+    targets.add_argument("--region", choices=sorted(REGIONS))
+    targets.add_argument("--loc", action="append", help="location; repeatable")
+    targets.add_argument("--months", default="2,3", help="with --loc, e.g., 4,5,6")
+    targets.add_argument("--years", default=DEFAULT_YEARS_ARG)
+
+    rendering = argparse.ArgumentParser(add_help=False)
+    rendering.add_argument("--view", choices=sorted(VIEWS), default="bars")
+    rendering.add_argument("--units", choices=sorted(units.SYSTEMS), default="imperial")
+    rendering.add_argument("--stream", action="store_true")
+    rendering.add_argument(
+        "--offline",
+        action="store_true",
+        help="only use cached data; fail on the first miss",
+    )
+    rendering.add_argument("--out", help="default: output/tester-<provider>.html")
+    rendering.add_argument(
+        "--render-workers",
+        type=int,
+        default=1,
+        help="processes rendering locations; 0 for one per core. not with --stream",
+    )
+    # the ranking up top; see compare.py
+    rendering.add_argument("--rank-months", help="e.g., 4,5; default: all")
+    rendering.add_argument("--hot", type=float, help="in --units; default: 90°F/32°C")
+    rendering.add_argument("--wet", type=float, help="in --units; default: 0.1in/2.5mm")
+
+    commands.add_parser(
+        "build", parents=[targets, rendering], help="fetch what's needed and render"
+    )
+    commands.add_parser(
+        "render", parents=[targets, rendering], help="render (see --offline)"
+    )
+    prefetch_parser = commands.add_parser(
+        "prefetch", parents=[targets], help="fill the cache; no rendering"
+    )
+    prefetch_parser.add_argument("--workers", type=int, default=8)
+    commands.add_parser(
+        "plan", parents=[targets], help="list cache misses and what fetching costs"
+    )
+    site_parser = commands.add_parser("site", help="a page per region (see sitegen.py)")
+    site_parser.add_argument("--offline", action="store_true")
+    site_parser.add_argument("--years", default=DEFAULT_YEARS_ARG)
+    map_parser = commands.add_parser(
+        "map", help="hot/rainy day maps over a region's grid (see grid.py)"
+    )
+    map_parser.add_argument("region", choices=sorted(GRID_REGIONS))
+    map_parser.add_argument("--step", type=float, default=0.5, help="degrees")
+    map_parser.add_argument("--months", default="4")
+    map_parser.add_argument("--years", default=DEFAULT_YEARS_ARG)
+    map_parser.add_argument("--workers", type=int, default=8)
+    map_parser.add_argument(
+        "--units", choices=sorted(units.SYSTEMS), default="imperial"
+    )
+    daemon_parser = commands.add_parser(
+        "daemon", help="keep caches warm on a schedule (see daemon.py)"
+    )
+    daemon_parser.add_argument(
+        "--provider",
+        action="append",
+        choices=sorted(PROVIDERS),
+        help="repeatable; default ms",
+    )
+    daemon_parser.add_argument("--cycles", type=int, help="default: forever")
+    serve_parser = commands.add_parser("serve", help="render on demand (see server.py)")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    import_parser = commands.add_parser("import-locations")
+    import_parser.add_argument("paths", nargs="+")
+    merge_parser = commands.add_parser("merge-cache")
+    merge_parser.add_argument("roots", nargs="+")
+    export_parser = commands.add_parser("export-locations")
+    export_parser.add_argument("path")
+    return parser.parse_args(argv)
+
+
+def targets(args: argparse.Namespace) -> List[Tuple[str, List[int]]]:
+    if args.loc is not None:
+        return [(loc, [int(m) for m in args.months.split(",")]) for loc in args.loc]
+    if args.region is not None:
+        return REGIONS[args.region]
+    return VC_LOCATIONS if args.provider == "vc" else MS_LOCATIONS
+
+
 if __name__ == "__main__":
-    os.makedirs("cache/vc/", exist_ok=True)
-    os.makedirs("cache/ms/", exist_ok=True)
+    args = parse_args(sys.argv[1:])
     ensure_file(LOCATION_CACHE_PATH, "{}\n")
     lc: LocationCache = json.loads(read(LOCATION_CACHE_PATH))
+    for root in STORE.shared_roots:
+        shared_lc_path = os.path.join(root, "locations.json")
+        if os.path.exists(shared_lc_path):
+            for name, latlon in json.loads(read(shared_lc_path)).items():
+                lc.setdefault(name, latlon)
+    migrate_cache_keys(lc)
 
-    # build_page_vc()
-    build_page_ms(lc)
+    years = [int(y) for y in getattr(args, "years", DEFAULT_YEARS_ARG).split(",")]
+    if args.command in ("build", "render"):
+        out = args.out or f"output/tester-{args.provider}.html"
+        rank_months = (
+            [int(m) for m in args.rank_months.split(",")] if args.rank_months else None
+        )
+        try:
+            build_page(
+                args.provider,
+                lc,
+                targets(args),
+                out,
+                args.view,
+                args.stream,
+                args.offline,
+                years,
+                units.SYSTEMS[args.units],
+                args.render_workers or None,
+                rank_months,
+                args.hot,
+                args.wet,
+            )
+        except cache.CacheMiss as e:
+            sys.exit(f"Not cached: {e}")
+    elif args.command == "prefetch":
+        prefetch(args.provider, lc, targets(args), years, args.workers)
+    elif args.command == "plan":
+        plan_fetches(args.provider, lc, targets(args), years)
+    elif args.command == "site":
+        try:
+            build_site(lc, offline=args.offline, years=years)
+        except cache.CacheMiss as e:
+            sys.exit(f"Not cached: {e}")
+    elif args.command == "map":
+        build_map(
+            lc,
+            args.region,
+            args.step,
+            [int(m) for m in args.months.split(",")],
+            years,
+            args.workers,
+            units.SYSTEMS[args.units],
+        )
+    elif args.command == "daemon":
+        keep_warm(lc, args.provider or ["ms"], args.cycles)
+    elif args.command == "serve":
+        serve(lc, args.port)
+    elif args.command == "import-locations":
+        for path in args.paths:
+            print(f"{gazetteer.import_locations(lc, path)} locations added from {path}")
+    elif args.command == "merge-cache":
+        for root in args.roots:
+            print(f"{STORE.merge(root)} cache entries merged from {root}")
+            shared_lc_path = os.path.join(root, "locations.json")
+            if os.path.exists(shared_lc_path):
+                gazetteer.import_locations(lc, shared_lc_path)
+    elif args.command == "export-locations":
+        gazetteer.export_locations(lc, args.path)
+    else:
+        # build_page_vc(lc)
+        build_page_ms(lc)
 
     write(LOCATION_CACHE_PATH, json.dumps(lc), False)
@@ -0,0 +1,110 @@
+"""Jinja templates in templates/, compiled once per process, with the compiled
+bytecode cached across runs in cache/jinja/.
+
+Templates are autoescaped, so HTML that's already rendered (e.g., fragments) has
+to be passed in as Markup.
+"""
+
+import calendar
+from functools import lru_cache
+import os
+from typing import Any, Sequence
+
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    select_autoescape,
+)
+from markupsafe import Markup
+
+import stats
+import units
+from dataset import (
+    SOURCE_INTERPOLATED,
+    SOURCE_MISSING,
+    SOURCE_OTHER_PROVIDER,
+    DataView,
+    day_sources,
+)
+
+TEMPLATE_DIR = "templates"
+BYTECODE_DIR = "cache/jinja"
+
+
+# how bars mark days that weren't observed (see dataset.SOURCE_*)
+FILLED_CLASSES = {
+    SOURCE_INTERPOLATED: " o-50",
+    SOURCE_OTHER_PROVIDER: " o-30",
+}
+
+
+def temp_color(temp: float, system: units.System = units.IMPERIAL) -> str:
+    """Bar color class for temp, in system's units."""
+    dark_red, red, yellow = system.colors
+    if temp > dark_red:
+        return "dark-red"
+    if temp > red:
+        return "red"
+    if temp > yellow:
+        return "yellow"
+    return "blue"
+
+
+@lru_cache(maxsize=None)
+def env() -> Environment:
+    os.makedirs(BYTECODE_DIR, exist_ok=True)
+    environment = Environment(
+        loader=FileSystemLoader(TEMPLATE_DIR),
+        bytecode_cache=FileSystemBytecodeCache(BYTECODE_DIR),
+        autoescape=select_autoescape(["html"]),
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+    environment.filters["temp_color"] = temp_color
+    environment.filters["month_name"] = lambda m: calendar.month_name[m]
+    environment.filters["summary"] = lambda s, system=units.IMPERIAL: Markup(
+        stats.render_summary(s, system)
+    )
+    environment.globals.update(MISSING=SOURCE_MISSING, FILLED=FILLED_CLASSES)
+    return environment
+
+
+def render(name: str, **context: Any) -> str:
+    return env().get_template(name).render(**context)
+
+
+def render_bars(
+    datas: Sequence[DataView],
+    key: str = "tempmax",
+    system: units.System = units.IMPERIAL,
+) -> str:
+    """Same markup as main.render_data, for many locations in one template call.
+    datas are in system's units."""
+    locations = []
+    for full_data in datas:
+        location_display, all_data = full_data
+        summary = stats.summarize(full_data, key, system)
+        month_summaries = iter(summary["months"])
+        years = []
+        for year, year_data in all_data:
+            months = []
+            for month, metrics in year_data:
+                sources = day_sources(metrics, key)
+                precip_sources = day_sources(metrics, "precip")
+                months.append(
+                    {
+                        "month": month,
+                        "days": list(zip(metrics[key], sources)),
+                        "precips": [
+                            0 if source == SOURCE_MISSING else precip
+                            for precip, source in zip(metrics["precip"], precip_sources)
+                        ],
+                        "summary": next(month_summaries),
+                    }
+                )
+            years.append((year, months))
+        locations.append(
+            {"name": location_display, "summary": summary["location"], "years": years}
+        )
+    return render("bars.html", locations=locations, system=system)
@@ -0,0 +1,115 @@
+"""Streaming pipeline: stages on their own threads, joined by bounded queues.
+
+Each stage is a function from one input item to an iterable of output items, so a
+stage can fan out (one location -> its months) or group (months -> one location).
+Stages run concurrently, so e.g. the network, parsing, and rendering overlap, and
+no more than `depth` items wait between any two stages.
+
+An exception in any stage stops the pipeline and is re-raised to the consumer.
+Once the consumer stops (on that, or by closing the generator early), every stage
+thread exits after its current item instead of blocking on a full queue.
+"""
+
+from queue import Empty, Full, Queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, List
+
+Stage = Callable[[Any], Iterable[Any]]
+
+DONE = object()
+
+# how often (seconds) a thread blocked on a queue checks whether to stop
+POLL = 0.1
+
+
+class Failed:
+    """Carries a stage's exception downstream to the consumer."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class Stopped(Exception):
+    """The consumer has stopped; see run()."""
+
+
+def _put(q: Queue, item: Any, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=POLL)
+            return
+        except Full:
+            pass
+    raise Stopped
+
+
+def _get(q: Queue, stop: threading.Event) -> Any:
+    while not stop.is_set():
+        try:
+            return q.get(timeout=POLL)
+        except Empty:
+            pass
+    raise Stopped
+
+
+def _feed(items: Iterable[Any], out_q: Queue, stop: threading.Event):
+    try:
+        try:
+            for item in items:
+                _put(out_q, item, stop)
+        except Stopped:
+            return
+        except BaseException as e:
+            _put(out_q, Failed(e), stop)
+        _put(out_q, DONE, stop)
+    except Stopped:
+        pass
+
+
+def _run_stage(stage: Stage, in_q: Queue, out_q: Queue, stop: threading.Event):
+    try:
+        while True:
+            item = _get(in_q, stop)
+            if item is DONE or isinstance(item, Failed):
+                _put(out_q, item, stop)
+                if item is DONE:
+                    return
+                continue
+            try:
+                for out in stage(item):
+                    _put(out_q, out, stop)
+            except Stopped:
+                raise
+            except BaseException as e:
+                _put(out_q, Failed(e), stop)
+    except Stopped:
+        pass
+
+
+def run(items: Iterable[Any], stages: List[Stage], depth: int = 8) -> Iterator[Any]:
+    """Yields the last stage's outputs, in order, as they're produced."""
+    queues: List[Queue] = [Queue(maxsize=depth) for _ in range(len(stages) + 1)]
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=_feed, args=(items, queues[0], stop), daemon=True)
+    ]
+    for i, stage in enumerate(stages):
+        threads.append(
+            threading.Thread(
+                target=_run_stage,
+                args=(stage, queues[i], queues[i + 1], stop),
+                daemon=True,
+            )
+        )
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is DONE:
+                return
+            if isinstance(item, Failed):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,199 @@
+"""Local HTTP server that renders locations on demand.
+
+GET /?loc=Tokyo, Japan&loc=Osaka, Japan&months=4,5,6
+    page with a placeholder per location, filled in as each one is ready
+GET /fragment?loc=Tokyo, Japan&months=4,5,6
+    one location's rendered bars. 202 while its data is still being fetched.
+
+Fragments are kept in an in-memory LRU. They're served with an ETag (the data's
+fingerprint) and Last-Modified, so browsers revalidate instead of re-downloading.
+Fetching runs on a single background thread, so cold locations never block the
+page, and we stay within Nominatim's one-request-at-a-time policy.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from email.utils import formatdate, parsedate_to_datetime
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from cache import LRU
+from dataset import Data, fingerprint
+
+# how long a request waits for its fragment before answering 202 instead.
+# long enough that warm-cache locations come back on the first request.
+WAIT_SECONDS = 0.25
+
+FragmentKey = Tuple[str, Tuple[int, ...]]
+
+"""(html, etag, last modified timestamp)"""
+Fragment = Tuple[str, str, float]
+
+PAGE_SCRIPT = """
+<script>
+async function fill(el) {
+    const res = await fetch(el.dataset.fragment);
+    if (res.status === 202) {
+        setTimeout(() => fill(el), 1000);
+        return;
+    }
+    el.innerHTML = await res.text();
+}
+document.querySelectorAll("[data-fragment]").forEach(fill);
+</script>
+"""
+
+
+class Renderer:
+    """Renders fragments in the background and keeps the recent ones around."""
+
+    def __init__(
+        self,
+        fetch: Callable[[str, List[int]], Data],
+        render: Callable[[Data], str],
+        maxsize: int = 256,
+    ):
+        self.fetch = fetch
+        self.render = render
+        self.fragments = LRU(maxsize)
+        self.pending: Dict[FragmentKey, Future] = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def _build(self, key: FragmentKey) -> Fragment:
+        location, months = key
+        try:
+            full_data = self.fetch(location, list(months))
+            fragment = (
+                self.render(full_data),
+                f'"{fingerprint(full_data)}"',
+                time.time(),
+            )
+            with self.lock:
+                self.fragments.put(key, fragment)
+            return fragment
+        finally:
+            with self.lock:
+                del self.pending[key]
+
+    def get(self, key: FragmentKey, wait: float = WAIT_SECONDS) -> Optional[Fragment]:
+        """Returns the fragment, or None if it's still being built."""
+        with self.lock:
+            fragment = self.fragments.get(key)
+            if fragment is not None:
+                return fragment
+            future = self.pending.get(key)
+            if future is None:
+                future = self.executor.submit(self._build, key)
+                self.pending[key] = future
+        try:
+            return future.result(timeout=wait)
+        except TimeoutError:
+            return None
+
+
+def parse_query(path: str) -> Tuple[str, List[str], Tuple[int, ...]]:
+    """Raises ValueError on a malformed months=, or one that isn't 1-12."""
+    url = urlparse(path)
+    query = parse_qs(url.query)
+    months = tuple(int(m) for m in query.get("months", ["2,3"])[0].split(","))
+    if not all(1 <= month <= 12 for month in months):
+        raise ValueError(f"months should be 1-12: {months}")
+    return url.path, query.get("loc", []), months
+
+
+def make_handler(renderer: Renderer, page: Callable[[str], str]):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            try:
+                path, locations, months = parse_query(self.path)
+            except ValueError:
+                self.send_error(400, "months should be 1-12, like 4,5,6")
+                return
+            if path == "/":
+                self.send_page(locations, months)
+            elif path == "/fragment" and len(locations) == 1:
+                self.send_fragment((locations[0], months))
+            else:
+                self.send_error(404)
+
+        def send_page(self, locations: List[str], months: Tuple[int, ...]):
+            buf = []
+            for location in locations:
+                query = urlencode(
+                    {"loc": location, "months": ",".join(str(m) for m in months)}
+                )
+                buf.append(
+                    f"<div data-fragment='/fragment?{escape(query)}'>"
+                    f"<h2 class='mt5 gray'>{escape(location)} (loading)</h2></div>"
+                )
+            buf.append(PAGE_SCRIPT)
+            self.send_body(200, page("\n".join(buf)))
+
+        def send_fragment(self, key: FragmentKey):
+            try:
+                fragment = renderer.get(key)
+            except Exception as e:
+                self.send_error(500, str(e))
+                return
+            if fragment is None:
+                self.send_body(202, "")
+                return
+            html, etag, last_modified = fragment
+            if self.not_modified(etag, last_modified):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_body(
+                200,
+                html,
+                {
+                    "ETag": etag,
+                    "Last-Modified": formatdate(last_modified, usegmt=True),
+                    "Cache-Control": "no-cache",
+                },
+            )
+
+        def not_modified(self, etag: str, last_modified: float) -> bool:
+            if "If-None-Match" in self.headers:
+                return etag in self.headers["If-None-Match"]
+            if "If-Modified-Since" in self.headers:
+                try:
+                    since = parsedate_to_datetime(self.headers["If-Modified-Since"])
+                except (TypeError, ValueError):
+                    return False
+                return int(last_modified) <= since.timestamp()
+            return False
+
+        def send_body(self, code: int, body: str, headers: Dict[str, str] = {}):
+            encoded = body.encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(encoded)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(encoded)
+
+    return Handler
+
+
+def serve(
+    fetch: Callable[[str, List[int]], Data],
+    render: Callable[[Data], str],
+    page: Callable[[str], str],
+    port: int = 8000,
+):
+    """Blocks, serving on localhost:port.
+
+    fetch(location, months) gets the data, render turns it into a fragment, and page
+    wraps fragments in the full page template.
+    """
+    renderer = Renderer(fetch, render)
+    httpd = ThreadingHTTPServer(("localhost", port), make_handler(renderer, page))
+    print(f"Serving on http://localhost:{port}/?loc=Tokyo, Japan&months=4,5,6")
+    httpd.serve_forever()
@@ -0,0 +1,138 @@
+"""Multi-page static site: one page per region, plus an index.
+
+Pages don't inline a styled div per day like render_data does. Each month is one
+element carrying its days as data attributes, and the shared static/chart.js draws
+the bars in the browser (styled by static/site.css), so pages stay small.
+
+Each page is named by its region. Its fingerprint (its data, plus the templates
+and assets it's built with) is kept in output/site/fingerprints.json, and pages
+whose fingerprint hasn't changed aren't rendered again. Changed pages are rendered
+in parallel, across processes.
+"""
+
+import calendar
+from concurrent.futures import ProcessPoolExecutor
+from html import escape
+import json
+import math
+import os
+import shutil
+from typing import Dict, List, Optional, Sequence
+
+from markupsafe import Markup
+from mbforbes_python_utils import read, write
+
+import compare
+import pages
+from dataset import SOURCE_MISSING, DataView, PackedData, fingerprint, source_key
+
+SITE_DIR = "output/site"
+STATIC_DIR = "static"
+ASSETS = ["site.css", "chart.js"]
+
+# bump when pages' markup changes, so they're all rebuilt
+SITE_VERSION = 1
+
+
+def days_attr(values, sources=None) -> str:
+    """Comma-separated values, to two decimals; missing days are empty."""
+    if sources is None:
+        sources = [0] * len(values)
+    return ",".join(
+        "" if s == SOURCE_MISSING or math.isnan(v) else f"{round(v, 2):g}"
+        for v, s in zip(values, sources)
+    )
+
+
+def render_chart(full_data: DataView, key: str = "tempmax") -> str:
+    """Same role as render_data, for static/chart.js to draw."""
+    location_display, all_data = full_data
+
+    buf = []
+    buf.append(f"<h2 class='mt5'>{escape(location_display)}</h2>")
+    for year, year_data in all_data:
+        buf.append("<div>")
+        for month, metrics in year_data:
+            sources = metrics.get(source_key(key))
+            buf.append(
+                f"<div class='month' data-temps='{days_attr(metrics[key], sources)}'"
+                f" data-precip='{days_attr(metrics['precip'], metrics.get(source_key('precip')))}'"
+                f" data-sources='{''.join(str(s) for s in sources or [])}'>"
+                f"<h3 class='mt1 mb3 tc gray'>{calendar.month_name[month]}, {year}</h3>"
+                "</div>"
+            )
+        buf.append("</div>")
+    return "\n".join(buf)
+
+
+def render_region(title: str, datas: Sequence[DataView], key: str) -> str:
+    summary = compare.render_ranking(compare.rank(compare.build_index(datas, key)))
+    content = "\n".join(render_chart(full_data, key) for full_data in datas)
+    return pages.render(
+        "site.html", title=title, summary=Markup(summary), content=Markup(content)
+    )
+
+
+def render_index(regions: Dict[str, List[PackedData]]) -> str:
+    buf = ["<ul class='list pl0 f4'>"]
+    for region, datas in regions.items():
+        names = ", ".join(escape(full_data[0]) for full_data in datas)
+        buf.append(
+            f"<li class='mb3'><a href='{region}.html'>{region}</a>"
+            f"<div class='f6 gray'>{names}</div></li>"
+        )
+    buf.append("</ul>")
+    return pages.render(
+        "site.html", title="weatherspread", summary="", content=Markup("\n".join(buf))
+    )
+
+
+def page_fingerprint(region: str, datas: Sequence[DataView], key: str) -> str:
+    build_inputs = [read("templates/site.html")] + [
+        read(os.path.join(STATIC_DIR, asset)) for asset in ASSETS
+    ]
+    return fingerprint((f"{region}/{key}/{SITE_VERSION}", [build_inputs, datas]))
+
+
+def build_site(
+    regions: Dict[str, List[PackedData]],
+    key: str = "tempmax",
+    workers: Optional[int] = None,
+    out_dir: str = SITE_DIR,
+):
+    """Writes out_dir/<region>.html for each region, index.html, and the assets.
+
+    regions' data should already be packed (see main.pack), as it's sent to worker
+    processes.
+    """
+    fingerprints_path = os.path.join(out_dir, "fingerprints.json")
+    old = (
+        json.loads(read(fingerprints_path)) if os.path.exists(fingerprints_path) else {}
+    )
+    new = {
+        region: page_fingerprint(region, datas, key)
+        for region, datas in regions.items()
+    }
+    stale = [
+        region
+        for region in regions
+        if old.get(region) != new[region]
+        or not os.path.exists(os.path.join(out_dir, region + ".html"))
+    ]
+
+    if len(stale) > 0:
+        n_workers = min(len(stale), workers or os.cpu_count() or 1)
+        args = ([regions[region] for region in stale], [key] * len(stale))
+        if n_workers == 1:
+            html_pages = list(map(render_region, stale, *args))
+        else:
+            with ProcessPoolExecutor(n_workers) as pool:
+                html_pages = list(pool.map(render_region, stale, *args))
+        for region, page in zip(stale, html_pages):
+            write(os.path.join(out_dir, region + ".html"), page)
+
+    write(os.path.join(out_dir, "index.html"), render_index(regions), False)
+    for asset in ASSETS:
+        shutil.copyfile(os.path.join(STATIC_DIR, asset), os.path.join(out_dir, asset))
+    write(fingerprints_path, json.dumps(new, indent=2, sort_keys=True) + "\n", False)
+    print(f"Site: {len(stale)} of {len(regions)} pages rebuilt in {out_dir}/")
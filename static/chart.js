@@ -0,0 +1,44 @@
+// Draws each .month's bars from its data attributes (see sitegen.render_chart).
+// Same look as main.render_data.
+
+const SOURCE_CLASSES = { "1": " interpolated", "2": " other-provider" };
+
+function tempColor(temp) {
+    if (temp > 100) return "dark-red";
+    if (temp > 90) return "red";
+    if (temp > 70) return "yellow";
+    return "blue";
+}
+
+function parseDays(attr) {
+    return attr.split(",").map((v) => (v === "" ? null : parseFloat(v)));
+}
+
+function drawMonth(el) {
+    const temps = parseDays(el.dataset.temps);
+    const precips = parseDays(el.dataset.precip);
+    const sources = el.dataset.sources;
+    const bars = [], labels = [], rain = [];
+    temps.forEach((temp, i) => {
+        if (temp === null) {
+            bars.push(`<div class="day missing" title="missing"></div>`);
+            labels.push(`<span class="label"></span>`);
+            return;
+        }
+        const filled = SOURCE_CLASSES[sources[i]] || "";
+        bars.push(
+            `<div class="day bg-${tempColor(temp)}${filled}" style="height: ${temp}px"></div>`
+        );
+        labels.push(`<span class="label">${Math.round(temp)}</span>`);
+    });
+    precips.forEach((precip) => {
+        rain.push(`<div class="day precip bg-blue" style="height: ${(precip || 0) * 10}px"></div>`);
+    });
+    el.insertAdjacentHTML(
+        "afterbegin",
+        bars.join("") + "<br>" + labels.join("") +
+        `<div class="precip-row">${rain.join("")}</div>`
+    );
+}
+
+document.querySelectorAll(".month[data-temps]").forEach(drawMonth);
@@ -0,0 +1,119 @@
+"""Per-month and per-location summaries: temperature mean/median/90th percentile,
+days past each of render_data's color thresholds, total precipitation, rain days.
+
+A location's months are stacked into one (months x 31) array per metric, padded
+with NaN, so every summary is one vectorized pass over the whole location.
+Summaries are cached in cache/stats/, named by a fingerprint of their inputs.
+"""
+
+import os
+from typing import Any, Dict, List
+import warnings
+
+import numpy as np
+import orjson
+
+import cache
+from dataset import DataView, fingerprint
+import units
+
+STATS_DIR = "cache/stats"
+
+# bump when what's computed changes, so old summaries aren't reused
+STATS_VERSION = 1
+
+"""{"days", "mean", "median", "p90", "over_70", ..., "precip", "rain_days"}, with
+an over_<t> for each of the unit system's color thresholds. Rain days have at
+least the system's wet (same as compare.py's) of precip."""
+Summary = Dict[str, Any]
+
+
+def month_matrix(full_data: DataView, metric: str) -> np.ndarray:
+    """(n months, 31) of metric, in full_data's order; NaN past each month's end."""
+    _, all_data = full_data
+    months = [metrics[metric] for _, year_data in all_data for _, metrics in year_data]
+    matrix = np.full((len(months), 31), np.nan)
+    for i, values in enumerate(months):
+        matrix[i, : len(values)] = values
+    return matrix
+
+
+def thresholds(system: units.System) -> List[float]:
+    """render_data's color thresholds, lowest first."""
+    return sorted(system.colors)
+
+
+def _summaries(
+    temps: np.ndarray, precip: np.ndarray, system: units.System
+) -> List[Summary]:
+    """One Summary per row."""
+    observed = ~np.isnan(temps)
+    with warnings.catch_warnings():
+        # all-NaN rows (nothing observed) just summarize to NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        columns = {
+            "days": observed.sum(axis=1),
+            "mean": np.nanmean(temps, axis=1),
+            "median": np.nanmedian(temps, axis=1),
+            "p90": np.nanpercentile(temps, 90, axis=1),
+            **{f"over_{t:g}": (temps > t).sum(axis=1) for t in thresholds(system)},
+            "precip": np.nansum(precip, axis=1),
+            "rain_days": (precip >= system.wet).sum(axis=1),
+        }
+    rows = []
+    for i in range(len(temps)):
+        row = {}
+        for name, column in columns.items():
+            value = column[i].item()
+            row[name] = None if value != value else round(value, 1)
+        rows.append(row)
+    return rows
+
+
+def compute(
+    full_data: DataView, key: str = "tempmax", system: units.System = units.IMPERIAL
+) -> Dict[str, Any]:
+    """{"location": Summary, "months": [Summary, ...] in full_data's order}.
+    full_data is in system's units."""
+    temps, precip = month_matrix(full_data, key), month_matrix(full_data, "precip")
+    return {
+        "location": _summaries(temps.reshape(1, -1), precip.reshape(1, -1), system)[0],
+        "months": _summaries(temps, precip, system),
+    }
+
+
+def summarize(
+    full_data: DataView, key: str = "tempmax", system: units.System = units.IMPERIAL
+) -> Dict[str, Any]:
+    """compute(), from cache/stats/ if it's been done for this data before."""
+    location_display, all_data = full_data
+    drawn = [
+        (year, month, list(metrics[key]), list(metrics["precip"]))
+        for year, year_data in all_data
+        for month, metrics in year_data
+    ]
+    name = fingerprint(
+        (f"{location_display}/{key}/{system.name}/{STATS_VERSION}", drawn)
+    )
+    path = os.path.join(STATS_DIR, name + ".json")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    summary = compute(full_data, key, system)
+    cache.write_atomic(path, orjson.dumps(summary))
+    return summary
+
+
+def render_summary(summary: Summary, system: units.System = units.IMPERIAL) -> str:
+    """One line of text, e.g., for under a month's heading."""
+    if summary["days"] == 0:
+        return "no data"
+    hot = ", ".join(
+        f"{summary[f'over_{t:g}']:g} &gt;{t:g}°" for t in thresholds(system)
+    )
+    return (
+        f"avg {summary['mean']:.0f}° · median {summary['median']:.0f}°"
+        f" · 90th pct {summary['p90']:.0f}° · {hot}"
+        f" · {summary['precip']:.1f}{system.precip_unit},"
+        f" {summary['rain_days']:g} rain days"
+    )
@@ -0,0 +1,111 @@
+"""Unit systems. Everything cached or archived is metric (see CANONICAL); pages are
+converted to a display System once per location, just before rendering, so metric
+and imperial pages both come from the same cache.
+"""
+
+from typing import Dict, NamedTuple, Tuple
+
+import numpy as np
+
+from dataset import Data
+
+# units of every stored metric that has any, whichever provider it came from
+CANONICAL = {
+    "tempmax": "°C",
+    "tempmin": "°C",
+    "temp": "°C",
+    "feelslikemax": "°C",
+    "feelslikemin": "°C",
+    "feelslike": "°C",
+    "dew": "°C",
+    "precip": "mm",
+    "snow": "cm",
+    "snowdepth": "cm",
+    "windgust": "km/h",
+    "windspeed": "km/h",
+    "pressure": "hPa",
+    "visibility": "km",
+}
+
+# decimals kept from values converted to canonical units (e.g., VC's, if fetched in
+# imperial), and to display units. fewer for display, so values that went through
+# both come back as they were.
+CANONICAL_DECIMALS = 4
+DISPLAY_DECIMALS = 3
+
+"""{metric: (scale, offset)}: shown value = canonical value * scale + offset"""
+Conversions = Dict[str, Tuple[float, float]]
+
+KM_PER_MILE = 1.609344
+
+TO_IMPERIAL: Conversions = {
+    **{metric: (1.8, 32.0) for metric, unit in CANONICAL.items() if unit == "°C"},
+    "precip": (1 / 25.4, 0.0),
+    "snow": (1 / 2.54, 0.0),
+    "snowdepth": (1 / 2.54, 0.0),
+    "windgust": (1 / KM_PER_MILE, 0.0),
+    "windspeed": (1 / KM_PER_MILE, 0.0),
+    "visibility": (1 / KM_PER_MILE, 0.0),
+}
+
+
+class System(NamedTuple):
+    name: str
+    conversions: Conversions
+    temp_unit: str
+    precip_unit: str
+    # bar colors: dark-red above the first, red above the second, yellow above
+    # the third, else blue
+    colors: Tuple[float, float, float]
+    # compare.py's nice days: not above hot, less than wet
+    hot: float
+    wet: float
+    # bar heights in px: temp * scale + offset, precip * scale. metric bars are
+    # as tall as imperial ones for the same weather.
+    temp_px: Tuple[float, float]
+    precip_px: float
+
+
+IMPERIAL = System(
+    "imperial", TO_IMPERIAL, "°F", "in", (100, 90, 70), 90, 0.1, (1.0, 0.0), 10.0
+)
+METRIC = System("metric", {}, "°C", "mm", (38, 32, 21), 32, 2.5, (1.8, 32.0), 10 / 25.4)
+
+SYSTEMS = {system.name: system for system in [IMPERIAL, METRIC]}
+
+
+def convert(full_data: Data, system: System) -> Data:
+    """full_data (canonical units) in system's units. Each metric is converted in
+    one array operation over all of the location's months; NaN stays NaN."""
+    if len(system.conversions) == 0:
+        return full_data
+    location_display, all_data = full_data
+    months = [metrics for _, year_data in all_data for _, metrics in year_data]
+    converted = [dict(metrics) for metrics in months]
+    for metric, (scale, offset) in system.conversions.items():
+        has = [i for i, metrics in enumerate(months) if metric in metrics]
+        if len(has) == 0:
+            continue
+        values = np.concatenate(
+            [np.asarray(months[i][metric], dtype=float) for i in has]
+        )
+        values = np.round(values * scale + offset, DISPLAY_DECIMALS)
+        ends = np.cumsum([len(months[i][metric]) for i in has])[:-1]
+        for i, part in zip(has, np.split(values, ends)):
+            converted[i][metric] = part.tolist()
+    it = iter(converted)
+    return (
+        location_display,
+        [
+            (year, [(month, next(it)) for month, _ in year_data])
+            for year, year_data in all_data
+        ],
+    )
+
+
+def from_imperial(values: np.ndarray, metric: str) -> np.ndarray:
+    """Inverse of TO_IMPERIAL, e.g., for data fetched in imperial units."""
+    if metric not in TO_IMPERIAL:
+        return values
+    scale, offset = TO_IMPERIAL[metric]
+    return (values - offset) / scale